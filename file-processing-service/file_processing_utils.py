@@ -1,70 +1,213 @@
 import os
 import base64
+import hashlib
+import json
 import logging
+import multiprocessing
+import shutil
+import sqlite3
+import tempfile
 import requests
-import time
-from typing import List, Dict, Tuple, Optional
-from dataclasses import dataclass
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from contextlib import ExitStack, contextmanager
+from typing import List, Dict, Tuple, Optional, Iterable, Set
+from dataclasses import dataclass, field
+from pypdf import PdfReader, PdfWriter
+from unstructured.chunking.title import chunk_by_title
 from unstructured.partition.pdf import partition_pdf
 from langchain_core.messages import HumanMessage
 from langchain_core.prompts import ChatPromptTemplate
 from langchain_core.output_parsers import StrOutputParser
 
+from summary_scheduler import SummarisationScheduler, SummaryJob
+
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+# Rough per-call token estimates used to charge the tokens-per-minute bucket
+OUTPUT_TOKEN_ESTIMATE = 512
+IMAGE_TOKEN_ESTIMATE = 258
+
+CHUNKING_KWARGS = dict(
+    max_characters=4000,
+    new_after_n_chars=3800,
+    combine_text_under_n_chars=2000,
+)
+
+def image_mime_type(path: str) -> str:
+    """MIME type of an extracted figure, from its extension."""
+    return "image/png" if path.lower().endswith(".png") else "image/jpeg"
+
+def _partition_shard(shard_path: str, image_folder: str, first_page: int) -> List:
+    """
+    Partition one page range without chunking (runs in a worker process).
+    Page numbers are rewritten to be relative to the whole document.
+    """
+    elements = partition_pdf(
+        filename=shard_path,
+        infer_table_structure=True,
+        strategy='hi_res',
+        extract_images_in_pdf=True,
+        extract_image_block_output_dir=image_folder
+    )
+    for element in elements:
+        if element.metadata.page_number is not None:
+            element.metadata.page_number += first_page - 1
+    return elements
+
 @dataclass
 class DocumentElements:
     texts: List[str]
     tables: List[str]
-    table_summaries: List[str]
-    image_base64: List[str]
-    image_summaries: List[str]
+    table_summaries: List[Optional[str]]
+    # Figures stay on disk until they are uploaded; only their paths are kept in memory
+    image_paths: List[str]
+    image_summaries: List[Optional[str]]
+    image_hashes: List[str] = field(default_factory=list)
+    # Source page of each text / table, when the partitioner reported one
+    text_pages: List[Optional[int]] = field(default_factory=list)
+    table_pages: List[Optional[int]] = field(default_factory=list)
+
+class CaptionedImageLedger:
+    """
+    Content hashes of images that were already captioned and pushed to the RAG store.
+    Backed by SQLite so several consumer processes can share it.
+    """
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        with self._connect() as conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS captioned_images (hash TEXT PRIMARY KEY)")
+
+    @contextmanager
+    def _connect(self):
+        conn = sqlite3.connect(self.db_path, timeout=30)
+        try:
+            conn.execute("PRAGMA journal_mode=WAL")
+            with conn:
+                yield conn
+        finally:
+            conn.close()
+
+    def seen(self, hashes: Iterable[str]) -> Set[str]:
+        """Return the subset of hashes that are already recorded"""
+        hashes = list(hashes)
+        if not hashes:
+            return set()
+        with self._connect() as conn:
+            placeholders = ",".join("?" for _ in hashes)
+            rows = conn.execute(f"SELECT hash FROM captioned_images WHERE hash IN ({placeholders})", hashes)
+            return {row[0] for row in rows}
+
+    def record(self, hashes: Iterable[str]) -> None:
+        with self._connect() as conn:
+            conn.executemany("INSERT OR IGNORE INTO captioned_images (hash) VALUES (?)", [(h,) for h in hashes])
 
 class DocumentProcessor:
-    def __init__(self, llm, api_base_url: str):
+    def __init__(
+        self,
+        llm,
+        api_base_url: str,
+        scheduler: Optional[SummarisationScheduler] = None,
+        image_ledger: Optional[CaptionedImageLedger] = None
+    ):
         self.llm = llm
         self.api_base_url = api_base_url
+        self.scheduler = scheduler or SummarisationScheduler.from_env()
+        # When set, images whose content hash is in the ledger are neither captioned nor pushed again
+        self.image_ledger = image_ledger
+        # Documents longer than shard_pages are partitioned page-range by page-range in parallel
+        self.partition_workers = int(os.getenv("PARTITION_WORKERS", os.cpu_count() or 1))
+        self.shard_pages = int(os.getenv("PARTITION_SHARD_PAGES", 25))
 
     def partition_document(self, path: str, file_name: str, image_folder: str) -> List:
         """
         Partition PDF document into elements using unstructured
         """
         try:
-            raw_pdf_elements = partition_pdf(
-                filename=os.path.join(path, file_name),
-                chunking_strategy="by_title",
-                max_characters=4000,
-                new_after_n_chars=3800,
-                combine_text_under_n_chars=2000,
-                infer_table_structure=True,
-                strategy='hi_res',
-                extract_images_in_pdf=True,
-                extract_image_block_output_dir= image_folder
-            )
+            file_path = os.path.join(path, file_name)
+            if self.partition_workers > 1 and len(PdfReader(file_path).pages) > self.shard_pages:
+                raw_pdf_elements = self.partition_document_sharded(file_path, image_folder)
+            else:
+                raw_pdf_elements = partition_pdf(
+                    filename=file_path,
+                    chunking_strategy="by_title",
+                    **CHUNKING_KWARGS,
+                    infer_table_structure=True,
+                    strategy='hi_res',
+                    extract_images_in_pdf=True,
+                    extract_image_block_output_dir= image_folder
+                )
             logger.info(f'Successfully Split {file_name}')
             return raw_pdf_elements
         except Exception as e:
             logger.error(f"Error partitioning document: {str(e)}")
             raise
 
-    def categorize_elements(self, raw_pdf_elements: List) -> Tuple[List[str], List[str]]:
+    def partition_document_sharded(self, file_path: str, image_folder: str) -> List:
+        """
+        Split the PDF into page ranges, partition them in parallel worker processes and
+        chunk the merged element stream by title, so sections that span a shard edge
+        end up in the same chunk exactly as with a single-pass partition.
+        """
+        reader = PdfReader(file_path)
+        page_count = len(reader.pages)
+        with tempfile.TemporaryDirectory(prefix="shards-") as shard_dir:
+            shards = []
+            for first_page in range(1, page_count + 1, self.shard_pages):
+                last_page = min(first_page + self.shard_pages - 1, page_count)
+                writer = PdfWriter()
+                for page_index in range(first_page - 1, last_page):
+                    writer.add_page(reader.pages[page_index])
+                shard_path = os.path.join(shard_dir, f"pages-{first_page:05d}-{last_page:05d}.pdf")
+                with open(shard_path, "wb") as shard_file:
+                    writer.write(shard_file)
+                shards.append((shard_path, os.path.join(shard_dir, f"figures-{first_page:05d}"), first_page))
+
+            logger.info(f"Partitioning {page_count} pages in {len(shards)} shards with {self.partition_workers} workers")
+            with ProcessPoolExecutor(
+                max_workers=min(self.partition_workers, len(shards)),
+                mp_context=multiprocessing.get_context("spawn")
+            ) as pool:
+                futures = [pool.submit(_partition_shard, *shard) for shard in shards]
+                # Results are collected in shard order, so the merged stream stays in page order
+                elements = [element for future in futures for element in future.result()]
+
+            # Shard-local figure names restart at page 1; prefix them with the shard's first page
+            os.makedirs(image_folder, exist_ok=True)
+            for _, shard_images, first_page in shards:
+                if not os.path.isdir(shard_images):
+                    continue
+                for image_name in sorted(os.listdir(shard_images)):
+                    shutil.move(
+                        os.path.join(shard_images, image_name),
+                        os.path.join(image_folder, f"p{first_page:05d}-{image_name}")
+                    )
+
+        return chunk_by_title(elements, **CHUNKING_KWARGS)
+
+    def categorize_elements(self, raw_pdf_elements: List) -> Tuple[List[str], List[str], List[Optional[int]], List[Optional[int]]]:
         """
-        Categorize PDF elements into tables and texts
+        Categorize PDF elements into tables and texts, with the page each one starts on
         """
         tables = []
         texts = []
+        table_pages = []
+        text_pages = []
         for element in raw_pdf_elements:
+            page = getattr(getattr(element, "metadata", None), "page_number", None)
             if "unstructured.documents.elements.Table" in str(type(element)):
                 tables.append(str(element))
+                table_pages.append(page)
             elif "unstructured.documents.elements.CompositeElement" in str(type(element)):
                 texts.append(str(element))
-        return texts, tables
+                text_pages.append(page)
+        return texts, tables, text_pages, table_pages
 
-    def summarize_tables(self, tables: List[str], table_rate_limit: int = 10) -> List[str]:
+    def summarize_tables(self, tables: List[str], label: str = "tables") -> List[Optional[str]]:
         """
-        Summarize tables using LLM
+        Summarize tables using LLM, concurrently within the configured rate limits.
+        A table whose summary failed gets None and is left out of the push.
         """
         prompt_text = """You are an assistant tasked with summarizing tables. \
                         Give a concise summary of the table. Table chunk: {element}"""
@@ -72,100 +215,126 @@ class DocumentProcessor:
         prompt = ChatPromptTemplate.from_template(prompt_text)
         summarize_chain = {"element": lambda x: x} | prompt | self.llm | StrOutputParser()
         
-        table_summaries = []
-        for idx, table in enumerate(tables, 1):
-            logger.info(f"Table Being Summarized: {idx}. Sleeping for {table_rate_limit}s to avoid rate limiting...")
-            try:
-                summary = summarize_chain.invoke(table)
-                table_summaries.append(summary)
-                if idx < len(tables):  # Don't sleep after the last table
-                    time.sleep(table_rate_limit)
-            except Exception as e:
-                logger.error(f"Error summarizing table {idx}: {str(e)}")
-                table_summaries.append(f"Error summarizing table: {str(e)}")
-        
-        return table_summaries
+        jobs = [
+            SummaryJob(
+                name=f"table {idx}",
+                call=lambda table=table: summarize_chain.invoke(table),
+                estimated_tokens=len(table) // 4 + OUTPUT_TOKEN_ESTIMATE
+            )
+            for idx, table in enumerate(tables, 1)
+        ]
+        return self.scheduler.run(
+            jobs,
+            label=label,
+            on_error=lambda job, e: None
+        )
 
-    def process_images(self, image_folder: str, image_rate_limit: int = 60) -> Tuple[List[str], List[str]]:
+    def process_images(self, image_folder: str, label: str = "images") -> Tuple[List[str], List[str], List[str]]:
         """
-        Process and summarize images from the specified folder
+        Process and summarize images from the specified folder, concurrently within the configured rate limits.
+        Returns the image paths, their summaries and their content hashes.
         """
-        def encode_image(image_path: str) -> str:
+        def caption(image_path: str) -> str:
+            # Read and encode only while this image's request is being built
             with open(image_path, "rb") as image_file:
-                return base64.b64encode(image_file.read()).decode('utf-8')
+                base64_image = base64.b64encode(image_file.read()).decode('utf-8')
+            message = HumanMessage(content=[
+                {"type": "text", "text": prompt},
+                {"type": "image_url", "image_url": {"url": f"data:{image_mime_type(image_path)};base64,{base64_image}"}}
+            ])
+            return self.llm.invoke([message]).content
 
         prompt = "Describe the image in detail. Be specific about graphs, such as bar plots."
-        img_base64_list = []
-        image_summaries = []
+        img_paths = []
+        img_hashes = []
+        jobs = []
 
         image_files = [f for f in sorted(os.listdir(image_folder)) 
                       if f.endswith(('.jpg', '.png'))]
-        
-        for idx, img_file in enumerate(image_files, 1):
-            try:
-                img_path = os.path.join(image_folder, img_file)
-                base64_image = encode_image(img_path)
-                img_base64_list.append(base64_image)
-                
-                message = HumanMessage(content=[
-                    {"type": "text", "text": prompt},
-                    {"type": "image_url", "image_url": {"url": f"data:image/jpeg;base64,{base64_image}"}}
-                ])
-                
-                logger.info(f"Image Being Summarized: {idx}. Sleeping for {image_rate_limit}s to avoid rate limiting...")
-                ai_msg = self.llm.invoke([message])
-                image_summaries.append(ai_msg.content)
-                
-                if idx < len(image_files):  # Don't sleep after the last image
-                    time.sleep(image_rate_limit)
-                    
-            except Exception as e:
-                logger.error(f"Error processing image {img_file}: {str(e)}")
-                image_summaries.append(f"Error processing image: {str(e)}")
-
-        return img_base64_list, image_summaries
-
-    def push_to_api(self, doc_elements: DocumentElements) -> bool:
+
+        images = {}
+        for img_file in image_files:
+            img_path = os.path.join(image_folder, img_file)
+            with open(img_path, "rb") as image_file:
+                img_hash = hashlib.sha256(image_file.read()).hexdigest()
+            # Identical figures (e.g. a logo on every page) are captioned once
+            images.setdefault(img_hash, img_path)
+
+        already_captioned = self.image_ledger.seen(images) if self.image_ledger else set()
+        if already_captioned:
+            logger.info(f"{label}: skipping {len(already_captioned)} images that were already captioned")
+
+        for img_hash, img_path in images.items():
+            if img_hash in already_captioned:
+                continue
+            img_paths.append(img_path)
+            img_hashes.append(img_hash)
+            jobs.append(SummaryJob(
+                name=f"image {os.path.basename(img_path)}",
+                call=lambda img_path=img_path: caption(img_path),
+                estimated_tokens=IMAGE_TOKEN_ESTIMATE + len(prompt) // 4 + OUTPUT_TOKEN_ESTIMATE
+            ))
+
+        # A failed caption is None: the image is left out of the push and of the ledger, so the
+        # next upload of the document captions it again instead of indexing an error message
+        image_summaries = self.scheduler.run(
+            jobs,
+            label=label,
+            on_error=lambda job, e: None
+        )
+        return img_paths, image_summaries, img_hashes
+
+    def push_to_api(self, doc_elements: DocumentElements, source: Optional[dict] = None) -> bool:
         """
-        Push processed document elements to API endpoints
+        Push processed document elements to the batch ingestion endpoint in one request
         """
         try:
-            if doc_elements.texts:
-                response = requests.post(
-                    f"{self.api_base_url}/api/insert-text",
-                    json={"texts": doc_elements.texts}
-                )
-                if response.status_code != 200:
-                    logger.error(f"Failed to insert texts: {response.text}")
-                    return False
+            text_pages = doc_elements.text_pages or [None] * len(doc_elements.texts)
+            table_pages = doc_elements.table_pages or [None] * len(doc_elements.tables)
+            elements = [
+                {"type": "text", "content": text, "page": page}
+                for text, page in zip(doc_elements.texts, text_pages)
+            ]
+            elements += [
+                {"type": "table", "content": table, "summary": summary, "page": page}
+                for table, summary, page in zip(doc_elements.tables, doc_elements.table_summaries, table_pages)
+                if summary
+            ]
+            images = [
+                (f"image-{i}{os.path.splitext(path)[1]}", path, summary)
+                for i, (path, summary) in enumerate(zip(doc_elements.image_paths, doc_elements.image_summaries))
+                if summary
+            ]
+            elements += [
+                {"type": "image", "file": part_name, "summary": summary, "mime_type": image_mime_type(path)}
+                for part_name, path, summary in images
+            ]
 
-
-            if doc_elements.tables and doc_elements.table_summaries:
-                response = requests.post(
-                    f"{self.api_base_url}/api/insert-table",
-                    json={
-                        "tables": doc_elements.tables,
-                        "table_summaries": doc_elements.table_summaries
-                    }
-                )
+            if elements:
+                # Images go as binary file parts next to a JSON manifest, never as base64
+                with ExitStack() as stack:
+                    files = [
+                        ("files", (part_name, stack.enter_context(open(path, "rb")), image_mime_type(path)))
+                        for part_name, path, _ in images
+                    ]
+                    response = requests.post(
+                        f"{self.api_base_url}/api/ingest/batch/multipart",
+                        data={"manifest": json.dumps({"elements": elements, "source": source or {}})},
+                        files=files
+                    )
                 if response.status_code != 200:
-                    logger.error(f"Failed to insert tables: {response.text}")
+                    logger.error(f"Failed to ingest batch: {response.text}")
                     return False
 
+            captioned_hashes = [
+                img_hash
+                for img_hash, summary in zip(doc_elements.image_hashes, doc_elements.image_summaries)
+                if summary
+            ]
+            if self.image_ledger and captioned_hashes:
+                self.image_ledger.record(captioned_hashes)
 
-            if doc_elements.image_base64 and doc_elements.image_summaries:
-                response = requests.post(
-                    f"{self.api_base_url}/api/insert-image",
-                    json={
-                        "image_b64_list": doc_elements.image_base64,
-                        "image_summaries": doc_elements.image_summaries
-                    }
-                )
-                if response.status_code != 200:
-                    logger.error(f"Failed to insert images: {response.text}")
-                    return False
-
-            logger.info("All data inserted successfully")
+            logger.info(f"All data inserted successfully ({len(elements)} elements)")
             return True
 
         except Exception as e:
@@ -177,13 +346,20 @@ class DocumentProcessor:
         Main method to process a document end-to-end
         """
         raw_elements = self.partition_document(path, file_name, image_folder=image_folder)
-        texts, tables = self.categorize_elements(raw_elements)
-        table_summaries = self.summarize_tables(tables)
-        img_base64_list, image_summaries = self.process_images(image_folder)
+        texts, tables, text_pages, table_pages = self.categorize_elements(raw_elements)
+        # Tables and images share the scheduler's rate limiter, so both can be in flight at once
+        with ThreadPoolExecutor(max_workers=2) as pool:
+            table_future = pool.submit(self.summarize_tables, tables, label=f"{file_name} tables")
+            image_future = pool.submit(self.process_images, image_folder, label=f"{file_name} images")
+            table_summaries = table_future.result()
+            image_paths, image_summaries, image_hashes = image_future.result()
         return DocumentElements(
             texts=texts,
             tables=tables,
             table_summaries=table_summaries,
-            image_base64=img_base64_list,
-            image_summaries=image_summaries
+            image_paths=image_paths,
+            image_summaries=image_summaries,
+            image_hashes=image_hashes,
+            text_pages=text_pages,
+            table_pages=table_pages
         )
\ No newline at end of file
@@ -1,13 +1,18 @@
 import json
 import os
+import shutil
 import requests
 import logging
-from kafka import KafkaConsumer
+import multiprocessing
+from collections import defaultdict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+from kafka import KafkaConsumer, OffsetAndMetadata
 from dotenv import load_dotenv
 from datetime import datetime
 import time
 
-from file_processing_utils import DocumentProcessor
+from file_processing_utils import CaptionedImageLedger, DocumentProcessor
+from summary_scheduler import SummarisationScheduler
 from get_llm import get_llm
 
 # Load environment variables
@@ -20,23 +25,86 @@ logging.basicConfig(
 )
 logger = logging.getLogger(__name__)
 
-class FileProcessingPipeline:
+class PartitionOffsetTracker:
+    """
+    Tracks in-flight offsets per partition so that only the contiguous prefix of
+    finished messages is committed, whatever order the workers finish in.
+    """
     def __init__(self):
+        self._pending = defaultdict(dict)  # partition -> {offset: finished}
+
+    def add(self, partition, offset):
+        self._pending[partition][offset] = False
+
+    def complete(self, partition, offset):
+        if offset in self._pending.get(partition, {}):
+            self._pending[partition][offset] = True
+
+    def forget(self, partitions):
+        """Drop partitions that were revoked from this consumer"""
+        for partition in partitions:
+            self._pending.pop(partition, None)
+
+    def committable(self):
+        """Pop finished prefixes and return {partition: next offset to consume}"""
+        commits = {}
+        for partition, offsets in self._pending.items():
+            next_offset = None
+            for offset in sorted(offsets):
+                if not offsets[offset]:
+                    break
+                del offsets[offset]
+                next_offset = offset + 1
+            if next_offset is not None:
+                commits[partition] = next_offset
+        return commits
+
+# Per-process pipeline used by pool workers; they never talk to Kafka themselves
+_worker_pipeline = None
+
+def _init_worker():
+    global _worker_pipeline
+    _worker_pipeline = FileProcessingPipeline(connect_consumer=False)
+
+def _handle_in_worker(value):
+    return _worker_pipeline.handle_message(value)
+
+class FileProcessingPipeline:
+    def __init__(self, connect_consumer: bool = True):
         # Configuration
         self.kafka_bootstrap_servers = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
         self.kafka_topic = os.getenv("KAFKA_TOPIC", "file_uploads")
         self.download_dir = os.getenv("DOWNLOAD_DIR", "downloaded_files")
         self.processed_dir = os.getenv("PROCESSED_DIR", "processed_files")
+        self.figures_dir = os.getenv("FIGURES_DIR", "figures")
+        # partition_pdf(hi_res) is CPU-bound, so concurrency comes from processes
+        self.max_workers = int(os.getenv("CONSUMER_WORKERS", 1))
+        self.max_in_flight = int(os.getenv("CONSUMER_MAX_IN_FLIGHT", self.max_workers))
         self.llm_api_key = os.getenv("GOOGLE_API_KEY")
 
-        self.llm = get_llm(api_key = self.llm_api_key)
-        self.api_base_url = os.getenv("INFERENCE_API_BASE_URL")
-        self.document_processor = DocumentProcessor(llm=self.llm, api_base_url=self.api_base_url)
-        
         # Ensure directories exist
         os.makedirs(self.download_dir, exist_ok=True)
         os.makedirs(self.processed_dir, exist_ok=True)
-        
+        os.makedirs(self.figures_dir, exist_ok=True)
+
+        self.llm = get_llm(api_key = self.llm_api_key)
+        self.api_base_url = os.getenv("INFERENCE_API_BASE_URL")
+        image_ledger = None
+        if os.getenv("INCREMENTAL_IMAGES", "true").lower() == "true":
+            image_ledger = CaptionedImageLedger(os.getenv("CAPTION_LEDGER_PATH", "captioned_images.db"))
+        # Pool workers split the LLM quota between them instead of each using all of it
+        scheduler = SummarisationScheduler.from_env(processes=1 if connect_consumer else self.max_workers)
+        self.document_processor = DocumentProcessor(
+            llm=self.llm,
+            api_base_url=self.api_base_url,
+            scheduler=scheduler,
+            image_ledger=image_ledger
+        )
+
+        if not connect_consumer:
+            self.consumer = None
+            return
+
         # Initialize Kafka consumer
         self.consumer = KafkaConsumer(
             self.kafka_topic,
@@ -79,16 +147,25 @@ class FileProcessingPipeline:
             with open(file_path, 'rb') as source, open(processed_path, 'wb') as dest:
                 dest.write(source.read())
             
+            # Each document extracts its figures into its own folder, so only its own images are captioned
+            image_folder = os.path.join(self.figures_dir, str(message['fileId']))
+            shutil.rmtree(image_folder, ignore_errors=True)
+            os.makedirs(image_folder)
+
             # Now process the copied file
             doc_elements = self.document_processor.process_document(
                 path=self.processed_dir,  # Pass the directory path
                 file_name=processed_filename,  # Pass just the filename
-                image_folder="figures"
+                image_folder=image_folder
             )
 
-            success = self.document_processor.push_to_api(doc_elements=doc_elements)
+            success = self.document_processor.push_to_api(
+                doc_elements=doc_elements,
+                source={"fileId": str(message['fileId']), "fileName": message['originalFileName']}
+            )
             if success:
                 logger.info("[Success]: Parsed document and fed to RAG Store")
+                shutil.rmtree(image_folder, ignore_errors=True)
             else:
                 logger.error("[Fail]: Unable to parse document and feed to RAG Store")
             
@@ -98,36 +175,41 @@ class FileProcessingPipeline:
             logger.error(f"Error processing file: {str(e)}")
             return False
     
+    def handle_message(self, value):
+        """Download, process and clean up the file announced by one message"""
+        logger.info(f"Received message: {value['fileId']}")
+
+        # Create file path; prefixed with the fileId so concurrent uploads of the same name don't collide
+        file_name = value['originalFileName']
+        file_path = os.path.join(self.download_dir, f"{value['fileId']}_{file_name}")
+
+        # Download file
+        if not self.download_file(value['downloadUrl'], file_path):
+            logger.error(f"Failed to download file: {file_name}")
+            return False
+        logger.info(f"File downloaded successfully: {file_name}")
+
+        # Process file
+        if not self.process_file(file_path, value):
+            logger.error(f"Failed to process file: {file_name}")
+            return False
+
+        # Clean up downloaded file
+        os.remove(file_path)
+        logger.info(f"Processed and cleaned up: {file_name}")
+        return True
+
     def run(self):
         """Main processing loop"""
+        if self.max_workers > 1:
+            return self.run_concurrent()
         try:
             logger.info("Starting file processing consumer...")
             for message in self.consumer:
                 try:
-                    value = message.value
-                    logger.info(f"Received message: {value['fileId']}")
-                    
-                    # Create file path
-                    file_name = value['originalFileName']
-                    file_path = os.path.join(self.download_dir, file_name)
-                    
-                    # Download file
-                    if self.download_file(value['downloadUrl'], file_path):
-                        logger.info(f"File downloaded successfully: {file_name}")
-                        
-                        # Process file
-                        if self.process_file(file_path, value):
-                            # Clean up downloaded file
-                            os.remove(file_path)
-                            logger.info(f"Processed and cleaned up: {file_name}")
-                            
-                            # Commit the offset
-                            self.consumer.commit()
-                        else:
-                            logger.error(f"Failed to process file: {file_name}")
-                    else:
-                        logger.error(f"Failed to download file: {file_name}")
-                        
+                    if self.handle_message(message.value):
+                        # Commit the offset
+                        self.consumer.commit()
                 except Exception as e:
                     logger.error(f"Error processing message: {str(e)}")
                     continue
@@ -137,8 +219,85 @@ class FileProcessingPipeline:
         finally:
             self.cleanup()
 
+    def run_concurrent(self):
+        """
+        Processing loop that fans messages out to a process pool. Offsets are committed
+        per partition once every earlier message of that partition has finished, and all
+        partitions are paused while the pool is full so fetched messages don't pile up.
+        """
+        pool = ProcessPoolExecutor(
+            max_workers=self.max_workers,
+            mp_context=multiprocessing.get_context("spawn"),
+            initializer=_init_worker
+        )
+        tracker = PartitionOffsetTracker()
+        in_flight = {}
+        paused = False
+        try:
+            logger.info(f"Starting file processing consumer with {self.max_workers} workers...")
+            while True:
+                if len(in_flight) >= self.max_in_flight:
+                    # Re-applied every round so partitions gained in a rebalance are paused too
+                    self.consumer.pause(*self.consumer.assignment())
+                    paused = True
+                    wait(in_flight, timeout=1.0, return_when=FIRST_COMPLETED)
+                    # Keep polling while paused so the group doesn't consider us dead
+                    records = self.consumer.poll(timeout_ms=0)
+                else:
+                    if paused:
+                        self.consumer.resume(*self.consumer.paused())
+                        paused = False
+                    records = self.consumer.poll(
+                        timeout_ms=500,
+                        max_records=self.max_in_flight - len(in_flight)
+                    )
+
+                for partition, messages in records.items():
+                    for message in messages:
+                        tracker.add(partition, message.offset)
+                        future = pool.submit(_handle_in_worker, message.value)
+                        in_flight[future] = (partition, message.offset, message.value.get('fileId'))
+
+                for future in [f for f in in_flight if f.done()]:
+                    partition, offset, file_id = in_flight.pop(future)
+                    try:
+                        if not future.result():
+                            logger.error(f"Failed to process message {file_id}, moving past it")
+                    except Exception as e:
+                        logger.error(f"Error processing message {file_id}: {str(e)}")
+                    tracker.complete(partition, offset)
+
+                self.commit_offsets(tracker)
+
+        except KeyboardInterrupt:
+            logger.info("Shutting down consumer...")
+        finally:
+            pool.shutdown(wait=True, cancel_futures=True)
+            self.cleanup()
+
+    def commit_offsets(self, tracker):
+        """Commit whatever contiguous prefixes have finished"""
+        commits = tracker.committable()
+        if not commits:
+            return
+        assigned = self.consumer.assignment()
+        revoked = [partition for partition in commits if partition not in assigned]
+        tracker.forget(revoked)
+        offsets = {
+            partition: OffsetAndMetadata(offset, '')
+            for partition, offset in commits.items()
+            if partition in assigned
+        }
+        try:
+            if offsets:
+                self.consumer.commit(offsets)
+        except Exception as e:
+            logger.error(f"Error committing offsets {offsets}: {str(e)}")
+
     def cleanup(self):
         """Cleanup resources"""
+        if self.consumer is None:
+            return
         try:
             self.consumer.close()
             logger.info("Consumer closed successfully")
@@ -0,0 +1,171 @@
+import logging
+import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from dataclasses import dataclass
+from typing import Any, Callable, List, Optional
+
+
+logger = logging.getLogger(__name__)
+
+
+def is_rate_limit_error(error: Exception) -> bool:
+    """True for quota errors (HTTP 429 / RESOURCE_EXHAUSTED) from the LLM client."""
+    for attr in ("code", "status_code"):
+        code = getattr(error, attr, None)
+        code = code() if callable(code) else code
+        if code == 429 or getattr(code, "value", None) == 429:
+            return True
+    message = str(error).lower()
+    return "429" in message or "resource exhausted" in message or "resource_exhausted" in message
+
+
+class TokenBucketLimiter:
+    """Thread-safe limiter enforcing both requests-per-minute and tokens-per-minute.
+
+    Each bucket holds up to one minute of budget and refills continuously. On a 429 the
+    refill rate is cut in half, then recovers gradually on every successful call.
+    """
+
+    def __init__(self, requests_per_minute: float, tokens_per_minute: float, min_rate_fraction: float = 0.1):
+        self.requests_per_minute = requests_per_minute
+        self.tokens_per_minute = tokens_per_minute
+        self.min_rate_fraction = min_rate_fraction
+        self._rate_fraction = 1.0
+        self._request_budget = float(requests_per_minute)
+        self._token_budget = float(tokens_per_minute)
+        self._last_refill = time.monotonic()
+        self._cond = threading.Condition()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        elapsed_minutes = (now - self._last_refill) / 60
+        self._last_refill = now
+        # A share of the quota below 1 RPM must still be able to fill up to one request
+        self._request_budget = min(
+            max(1.0, self.requests_per_minute),
+            self._request_budget + elapsed_minutes * self.requests_per_minute * self._rate_fraction,
+        )
+        self._token_budget = min(
+            self.tokens_per_minute,
+            self._token_budget + elapsed_minutes * self.tokens_per_minute * self._rate_fraction,
+        )
+
+    def acquire(self, tokens: int = 0) -> None:
+        """Block until one request and `tokens` tokens are available, then consume them."""
+        tokens = min(tokens, self.tokens_per_minute)
+        with self._cond:
+            while True:
+                self._refill()
+                if self._request_budget >= 1 and self._token_budget >= tokens:
+                    self._request_budget -= 1
+                    self._token_budget -= tokens
+                    return
+                request_wait = (1 - self._request_budget) / (self.requests_per_minute * self._rate_fraction)
+                token_wait = (tokens - self._token_budget) / (self.tokens_per_minute * self._rate_fraction)
+                self._cond.wait(timeout=max(request_wait, token_wait, 0) * 60 + 0.01)
+
+    def on_rate_limited(self) -> None:
+        """Halve the refill rate and drain the buckets after a 429."""
+        with self._cond:
+            self._rate_fraction = max(self.min_rate_fraction, self._rate_fraction / 2)
+            self._request_budget = min(self._request_budget, 0)
+            logger.warning(f"Rate limited by LLM provider, refill rate now {self._rate_fraction:.0%} of quota")
+
+    def on_success(self) -> None:
+        """Recover the refill rate slowly after successful calls."""
+        with self._cond:
+            if self._rate_fraction < 1.0:
+                self._rate_fraction = min(1.0, self._rate_fraction * 1.1)
+                self._cond.notify_all()
+
+
+@dataclass
+class SummaryJob:
+    name: str
+    call: Callable[[], Any]
+    estimated_tokens: int = 0
+
+
+class SummarisationScheduler:
+    """Runs LLM summarisation jobs concurrently within the configured quota."""
+
+    def __init__(
+        self,
+        limiter: TokenBucketLimiter,
+        max_workers: int = 4,
+        max_retries: int = 5,
+        base_backoff: float = 2.0,
+        max_backoff: float = 60.0,
+    ):
+        self.limiter = limiter
+        self.max_workers = max_workers
+        self.max_retries = max_retries
+        self.base_backoff = base_backoff
+        self.max_backoff = max_backoff
+
+    @classmethod
+    def from_env(cls, processes: int = 1) -> "SummarisationScheduler":
+        """Build a scheduler from LLM_* environment variables.
+
+        The quota is for the whole service: when `processes` pool workers each build their
+        own scheduler, every one of them gets an equal share of it.
+        """
+        processes = max(1, processes)
+        limiter = TokenBucketLimiter(
+            requests_per_minute=float(os.getenv("LLM_REQUESTS_PER_MINUTE", 15)) / processes,
+            tokens_per_minute=float(os.getenv("LLM_TOKENS_PER_MINUTE", 1_000_000)) / processes,
+        )
+        return cls(
+            limiter=limiter,
+            max_workers=int(os.getenv("LLM_MAX_CONCURRENCY", 4)),
+            max_retries=int(os.getenv("LLM_MAX_RETRIES", 5)),
+        )
+
+    def _run_job(self, job: SummaryJob) -> Any:
+        attempt = 0
+        while True:
+            self.limiter.acquire(job.estimated_tokens)
+            try:
+                result = job.call()
+                self.limiter.on_success()
+                return result
+            except Exception as e:
+                if not is_rate_limit_error(e) or attempt >= self.max_retries:
+                    raise
+                self.limiter.on_rate_limited()
+                delay = min(self.max_backoff, self.base_backoff * (2 ** attempt))
+                attempt += 1
+                logger.warning(f"{job.name} hit the rate limit, retry {attempt}/{self.max_retries} in {delay:.1f}s")
+                time.sleep(delay)
+
+    def run(
+        self,
+        jobs: List[SummaryJob],
+        label: str = "",
+        on_error: Optional[Callable[[SummaryJob, Exception], Any]] = None,
+    ) -> List[Any]:
+        """Run jobs concurrently and return their results in submission order.
+
+        A job that still fails after retries yields on_error(job, error), or re-raises if
+        no on_error is given.
+        """
+        if not jobs:
+            return []
+        results: List[Any] = [None] * len(jobs)
+        done = 0
+        with ThreadPoolExecutor(max_workers=min(self.max_workers, len(jobs))) as pool:
+            futures = {pool.submit(self._run_job, job): idx for idx, job in enumerate(jobs)}
+            for future in as_completed(futures):
+                idx = futures[future]
+                try:
+                    results[idx] = future.result()
+                except Exception as e:
+                    if on_error is None:
+                        raise
+                    logger.error(f"Error in {jobs[idx].name}: {str(e)}")
+                    results[idx] = on_error(jobs[idx], e)
+                done += 1
+                logger.info(f"{label} progress: {done}/{len(jobs)} ({jobs[idx].name} finished)")
+        return results
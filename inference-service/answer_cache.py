@@ -0,0 +1,177 @@
+import os
+import re
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from dataclasses import dataclass
+from typing import Dict, FrozenSet, Iterable, Iterator, List, Optional, Set
+
+import numpy as np
+
+
+ANSWER_CACHE_SIZE = int(os.getenv("ANSWER_CACHE_SIZE", 2000))
+ANSWER_CACHE_TTL_SECONDS = float(os.getenv("ANSWER_CACHE_TTL_SECONDS", 24 * 3600))
+ANSWER_CACHE_SIMILARITY = float(os.getenv("ANSWER_CACHE_SIMILARITY", 0.95))
+
+
+@dataclass
+class CachedAnswer:
+    question: str
+    vector: np.ndarray
+    doc_ids: FrozenSet[str]
+    answer: str
+    expires_at: float
+    # Docstore generations of doc_ids when the answer was built (None if not tracked)
+    generations: Optional[Dict[str, int]] = None
+
+
+def retrieved_doc_ids(docs) -> Optional[FrozenSet[str]]:
+    """doc_ids of tagged docstore entries, or None if any entry has none (legacy entries)."""
+    doc_ids = set()
+    for doc in docs:
+        doc_id = doc.get("doc_id") if isinstance(doc, dict) else None
+        if not doc_id:
+            return None
+        doc_ids.add(doc_id)
+    return frozenset(doc_ids)
+
+
+def replay_chunks(answer: str) -> Iterator[str]:
+    """Split a cached answer into word-sized chunks so it streams like a fresh one."""
+    yield from re.findall(r"\S+\s*|\s+", answer)
+
+
+class SemanticAnswerCache:
+    """
+    Answers keyed by the question embedding and the exact set of retrieved doc_ids.
+
+    A lookup only considers entries built from the same documents, and returns the most
+    similar one whose cosine similarity reaches the threshold. Entries expire after
+    ttl_seconds, the least recently used are evicted beyond max_entries, and every entry
+    that used a document is dropped when that document is invalidated.
+
+    invalidate_documents only reaches this process's cache. Other workers notice through
+    the docstore generations passed to lookup: an entry built from an older generation of
+    any of its documents is dropped instead of served.
+    """
+
+    def __init__(
+        self,
+        max_entries: int = ANSWER_CACHE_SIZE,
+        ttl_seconds: float = ANSWER_CACHE_TTL_SECONDS,
+        similarity_threshold: float = ANSWER_CACHE_SIMILARITY,
+    ):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.similarity_threshold = similarity_threshold
+        self._entries: "OrderedDict[str, CachedAnswer]" = OrderedDict()
+        self._by_doc_set: Dict[FrozenSet[str], Set[str]] = {}
+        self._by_doc_id: Dict[str, Set[str]] = {}
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.invalidations = 0
+
+    @staticmethod
+    def _normalize(vector: Iterable[float]) -> np.ndarray:
+        array = np.asarray(vector, dtype=np.float32)
+        norm = float(np.linalg.norm(array))
+        return array / norm if norm else array
+
+    def _remove(self, key: str) -> None:
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return
+        keys = self._by_doc_set.get(entry.doc_ids)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._by_doc_set[entry.doc_ids]
+        for doc_id in entry.doc_ids:
+            keys = self._by_doc_id.get(doc_id)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._by_doc_id[doc_id]
+
+    def lookup(
+        self,
+        question_vector: List[float],
+        doc_ids: FrozenSet[str],
+        generations: Optional[Dict[str, int]] = None,
+    ) -> Optional[str]:
+        """Cached answer for a question similar enough to one answered from the same documents.
+
+        generations are the documents' current docstore generations; stale entries are dropped.
+        """
+        query = self._normalize(question_vector)
+        now = time.monotonic()
+        with self._lock:
+            best_key, best_score = None, self.similarity_threshold
+            for key in list(self._by_doc_set.get(doc_ids, ())):
+                entry = self._entries[key]
+                if entry.expires_at < now:
+                    self._remove(key)
+                    continue
+                if generations is not None and entry.generations is not None and entry.generations != generations:
+                    self._remove(key)
+                    self.invalidations += 1
+                    continue
+                score = float(np.dot(query, entry.vector))
+                if score >= best_score:
+                    best_key, best_score = key, score
+            if best_key is None:
+                self.misses += 1
+                return None
+            self._entries.move_to_end(best_key)
+            self.hits += 1
+            return self._entries[best_key].answer
+
+    def put(
+        self,
+        question: str,
+        question_vector: List[float],
+        doc_ids: FrozenSet[str],
+        answer: str,
+        generations: Optional[Dict[str, int]] = None,
+    ) -> None:
+        """Cache an answer; generations should be read before the documents were used."""
+        key = uuid.uuid4().hex
+        entry = CachedAnswer(
+            question=question,
+            vector=self._normalize(question_vector),
+            doc_ids=doc_ids,
+            answer=answer,
+            expires_at=time.monotonic() + self.ttl_seconds,
+            generations=generations,
+        )
+        with self._lock:
+            self._entries[key] = entry
+            self._by_doc_set.setdefault(doc_ids, set()).add(key)
+            for doc_id in doc_ids:
+                self._by_doc_id.setdefault(doc_id, set()).add(key)
+            while len(self._entries) > self.max_entries:
+                self._remove(next(iter(self._entries)))
+
+    def invalidate_documents(self, doc_ids: Iterable[str]) -> int:
+        """Drop every answer that was built from any of doc_ids; returns how many were dropped."""
+        with self._lock:
+            keys = set()
+            for doc_id in doc_ids:
+                keys.update(self._by_doc_id.get(doc_id, ()))
+            for key in keys:
+                self._remove(key)
+            self.invalidations += len(keys)
+            return len(keys)
+
+    def stats(self) -> dict:
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                "entries": len(self._entries),
+                "hits": self.hits,
+                "misses": self.misses,
+                "invalidations": self.invalidations,
+                "hit_rate": round(self.hits / lookups, 4) if lookups else 0.0,
+            }
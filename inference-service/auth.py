@@ -1,7 +1,12 @@
 # auth
+import asyncio
 import os
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from dataclasses import dataclass
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import Dict, Optional, Tuple
 
 from fastapi import Depends, HTTPException, status
 from fastapi.security import OAuth2PasswordBearer
@@ -9,8 +14,10 @@ from jose import JWTError, jwt
 from passlib.context import CryptContext
 from pydantic import BaseModel, EmailStr, field_validator
 import re
+from sqlalchemy import event, inspect
 from sqlalchemy.orm import Session
 
+from database import get_db
 from logger import logger
 
 # Security configurations
@@ -19,9 +26,20 @@ REFRESH_SECRET_KEY = os.getenv("REFRESH_SECRET_KEY", "your-separate-long-and-ran
 ALGORITHM = "HS256"
 ACCESS_TOKEN_EXPIRE_MINUTES = 30
 REFRESH_TOKEN_EXPIRE_DAYS = 7
+PRINCIPAL_CACHE_TTL_SECONDS = float(os.getenv("PRINCIPAL_CACHE_TTL_SECONDS", 60))
+BCRYPT_ROUNDS = int(os.getenv("BCRYPT_ROUNDS", 12))
+PASSWORD_HASH_WORKERS = int(os.getenv("PASSWORD_HASH_WORKERS", 2))
+PASSWORD_HASH_QUEUE_LIMIT = int(os.getenv("PASSWORD_HASH_QUEUE_LIMIT", 32))
 
 # Password and validation helpers
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Hashes made with any other cost factor are flagged for rehashing on the next login
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__default_rounds=BCRYPT_ROUNDS,
+    bcrypt__min_rounds=BCRYPT_ROUNDS,
+    bcrypt__max_rounds=BCRYPT_ROUNDS,
+)
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token")
 
 class UserCreate(BaseModel):
@@ -84,14 +102,85 @@ def get_password_hash(password: str):
     """Hash user password"""
     return pwd_context.hash(password)
 
-def authenticate_user(db: Session, username: str, password: str):
-    """Authenticate user credentials"""
-    from models import User
-    user = db.query(User).filter(User.username == username).first()
+class PasswordHasher:
+    """
+    Runs bcrypt on a small dedicated thread pool so a burst of logins can't occupy the
+    event loop or the threads serving other endpoints. Work beyond workers + queue_limit
+    is rejected with a 429 instead of queueing without bound.
+    """
+
+    def __init__(self, context: CryptContext, workers: int, queue_limit: int):
+        self.context = context
+        self.capacity = workers + queue_limit
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="password-hash")
+        self._lock = threading.Lock()
+        self.in_flight = 0
+        self.counters = {"hashed": 0, "verified": 0, "failed": 0, "rehashed": 0, "rejected": 0}
+        self._busy_seconds = 0.0
+
+    def _timed(self, fn, *args):
+        started = time.perf_counter()
+        try:
+            return fn(*args)
+        finally:
+            elapsed = time.perf_counter() - started
+            with self._lock:
+                self._busy_seconds += elapsed
+
+    async def _run(self, fn, *args):
+        with self._lock:
+            if self.in_flight >= self.capacity:
+                self.counters["rejected"] += 1
+                raise HTTPException(
+                    status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+                    detail="Too many authentication requests, please retry shortly",
+                    headers={"Retry-After": "1"},
+                )
+            self.in_flight += 1
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, self._timed, fn, *args)
+        finally:
+            with self._lock:
+                self.in_flight -= 1
+
+    async def hash(self, password: str) -> str:
+        hashed = await self._run(self.context.hash, password)
+        self.counters["hashed"] += 1
+        return hashed
+
+    async def verify_and_update(self, password: str, hashed_password: str) -> Tuple[bool, Optional[str]]:
+        """(valid, new_hash); new_hash is set when the stored hash used an outdated cost factor."""
+        valid, new_hash = await self._run(self.context.verify_and_update, password, hashed_password)
+        self.counters["verified" if valid else "failed"] += 1
+        return valid, new_hash
+
+    def stats(self) -> dict:
+        with self._lock:
+            operations = self.counters["hashed"] + self.counters["verified"] + self.counters["failed"]
+            return {
+                **self.counters,
+                "in_flight": self.in_flight,
+                "capacity": self.capacity,
+                "avg_ms": round(1000 * self._busy_seconds / operations, 2) if operations else None,
+            }
+
+password_hasher = PasswordHasher(pwd_context, PASSWORD_HASH_WORKERS, PASSWORD_HASH_QUEUE_LIMIT)
+
+async def authenticate_user(db: Session, username: str, password: str):
+    """Authenticate user credentials, upgrading the stored hash if its cost factor is outdated"""
+    # Session work runs in a worker thread like the KDF, so a login storm never blocks the event loop
+    user = await asyncio.to_thread(get_user, db, username)
     if not user:
         return False
-    if not verify_password(password, user.hashed_password):
+    valid, new_hash = await password_hasher.verify_and_update(password, user.hashed_password)
+    if not valid:
         return False
+    if new_hash is not None:
+        user.hashed_password = new_hash
+        await asyncio.to_thread(db.commit)
+        password_hasher.counters["rehashed"] += 1
+        logger.info(f"Rehashed password for {username} with {BCRYPT_ROUNDS} rounds")
     return user
 
 def get_user(db: Session, username: str):
@@ -99,20 +188,61 @@ def get_user(db: Session, username: str):
     from models import User
     return db.query(User).filter(User.username == username).first()
 
-def get_db():
-    """Database session generator"""
-    from sqlalchemy import create_engine
-    from sqlalchemy.orm import sessionmaker
-    
-    DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./users.db")
-    engine = create_engine(DATABASE_URL)
-    SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
-    
-    db = SessionLocal()
-    try:
-        yield db
-    finally:
-        db.close()
+@dataclass(frozen=True)
+class Principal:
+    """The authenticated user as seen by request handlers (no password hash, no session)."""
+    id: int
+    username: str
+    email: str
+    is_active: bool
+
+    @classmethod
+    def from_user(cls, user) -> "Principal":
+        return cls(id=user.id, username=user.username, email=user.email, is_active=user.is_active)
+
+class PrincipalCache:
+    """Short-TTL username -> Principal cache so authenticated calls skip the users query."""
+
+    def __init__(self, ttl_seconds: float):
+        self.ttl_seconds = ttl_seconds
+        self._entries: Dict[str, Tuple[float, Principal]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, username: str) -> Optional[Principal]:
+        with self._lock:
+            entry = self._entries.get(username)
+            if entry is None:
+                return None
+            if entry[0] < time.monotonic():
+                del self._entries[username]
+                return None
+            return entry[1]
+
+    def put(self, principal: Principal) -> None:
+        if self.ttl_seconds <= 0:
+            return
+        with self._lock:
+            self._entries[principal.username] = (time.monotonic() + self.ttl_seconds, principal)
+
+    def invalidate(self, username: str) -> None:
+        with self._lock:
+            self._entries.pop(username, None)
+
+principal_cache = PrincipalCache(PRINCIPAL_CACHE_TTL_SECONDS)
+
+def _invalidate_principal(mapper, connection, target):
+    """Drop the cached principal whenever its user row is updated or deleted."""
+    principal_cache.invalidate(target.username)
+    # A rename leaves the old username cached too
+    for username in inspect(target).attrs.username.history.deleted or ():
+        principal_cache.invalidate(username)
+
+def _register_principal_invalidation():
+    from models import User
+    event.listen(User, "after_update", _invalidate_principal)
+    event.listen(User, "after_delete", _invalidate_principal)
+
+_register_principal_invalidation()
 
 def get_current_user(
     token: str = Depends(oauth2_scheme), 
@@ -137,11 +267,15 @@ def get_current_user(
     except JWTError:
         raise credentials_exception
     
-    user = get_user(db, username=username)
-    if user is None:
-        raise credentials_exception
+    principal = principal_cache.get(username)
+    if principal is None:
+        user = get_user(db, username=username)
+        if user is None:
+            raise credentials_exception
+        principal = Principal.from_user(user)
+        principal_cache.put(principal)
     logger.info("[VALID] User check successful!")
-    return user
+    return principal
 
 def verify_refresh_token(refresh_token: str, db: Session):
     """Verify refresh token and return user"""
@@ -0,0 +1,100 @@
+import os
+import threading
+import time
+from typing import Callable, Dict, Tuple
+
+from langchain_core.runnables import Runnable, RunnableConfig, RunnableLambda
+
+from logger import logger
+from rag_utils import prompt_func, split_image_text_types
+
+
+LLM_MODEL = os.getenv("LLM_MODEL", "gemini-1.5-flash")
+LLM_TEMPERATURE = float(os.getenv("LLM_TEMPERATURE", 0))
+
+
+def _prompt_inputs(inputs: dict, config: RunnableConfig) -> dict:
+    """Per-request prompt inputs: documents come in the input, history through the config."""
+    configurable = config.get("configurable", {})
+    return {
+        "context": split_image_text_types(inputs["docs"]),
+        "question": inputs["question"],
+        "chat_history": configurable.get("chat_history", []),
+        "history_summary": configurable.get("history_summary"),
+    }
+
+
+class ChainRegistry:
+    """
+    Builds each LLM client and RAG chain once per (model, temperature, streaming) and hands
+    out the same runnable to every request. Clients keep their transports between requests;
+    everything request-specific travels in the input and config, so the graph is shared.
+
+    The RAG chain takes {"question": str, "docs": [retrieved entries]} and reads
+    chat_history / history_summary from config["configurable"]. It yields message chunks
+    rather than strings so the provider's usage_metadata reaches the caller.
+    """
+
+    def __init__(self, llm_factory: Callable, model_name: str = LLM_MODEL, temperature: float = LLM_TEMPERATURE):
+        self.llm_factory = llm_factory
+        self.model_name = model_name
+        self.temperature = temperature
+        self._llms: Dict[Tuple, object] = {}
+        self._chains: Dict[Tuple, Runnable] = {}
+        self._lock = threading.Lock()
+        self.builds = 0
+        self.lookups = 0
+        self._setup_seconds = 0.0
+
+    def llm(self, streaming: bool = True):
+        key = (self.model_name, self.temperature, streaming)
+        with self._lock:
+            if key not in self._llms:
+                self._llms[key] = self.llm_factory(
+                    model_name=self.model_name, temperature=self.temperature, allow_streaming=streaming
+                )
+            return self._llms[key]
+
+    def rag_chain(self, streaming: bool = True, debug: bool = True) -> Runnable:
+        """The shared RAG chain, built on first use."""
+        started_at = time.perf_counter()
+        key = (self.model_name, self.temperature, streaming, debug)
+        chain = self._chains.get(key)
+        if chain is None:
+            llm = self.llm(streaming=streaming)
+            with self._lock:
+                chain = self._chains.get(key)
+                if chain is None:
+                    chain = (
+                        RunnableLambda(_prompt_inputs)
+                        | RunnableLambda(lambda x: prompt_func(x, debug=debug))
+                        | llm
+                    )
+                    self._chains[key] = chain
+                    self.builds += 1
+                    logger.info(f"Built RAG chain for {key}")
+        elapsed = time.perf_counter() - started_at
+        with self._lock:
+            self.lookups += 1
+            self._setup_seconds += elapsed
+        return chain
+
+    async def warm_up(self) -> None:
+        """Build the chains and open the LLM connection with a tiny call."""
+        self.rag_chain(streaming=True)
+        llm = self.llm(streaming=False)
+        started_at = time.perf_counter()
+        try:
+            await llm.ainvoke("Reply with OK.")
+            logger.info(f"LLM connection warmed up in {(time.perf_counter() - started_at) * 1000:.1f} ms")
+        except Exception as e:
+            logger.warning(f"LLM warm-up call failed, the first request will open the connection: {str(e)}")
+
+    def stats(self) -> dict:
+        with self._lock:
+            return {
+                "chains": len(self._chains),
+                "builds": self.builds,
+                "lookups": self.lookups,
+                "avg_setup_ms": round(1000 * self._setup_seconds / self.lookups, 4) if self.lookups else None,
+            }
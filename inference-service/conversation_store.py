@@ -0,0 +1,336 @@
+import asyncio
+import base64
+import json
+import queue
+import threading
+import time
+from collections import OrderedDict
+from datetime import datetime
+from typing import List, Optional, Tuple
+
+from sqlalchemy import and_, delete, or_, select, update
+from sqlalchemy.orm import selectinload
+
+from logger import logger
+from models import Conversation, Message
+
+
+def encode_cursor(updated_at: datetime, conversation_id: str) -> str:
+    """Opaque cursor pointing just after (updated_at, id) in the listing order."""
+    raw = json.dumps([updated_at.isoformat(), conversation_id]).encode("utf-8")
+    return base64.urlsafe_b64encode(raw).decode("ascii")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, str]:
+    """Inverse of encode_cursor; raises ValueError for malformed cursors."""
+    try:
+        updated_at, conversation_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+        return datetime.fromisoformat(updated_at), str(conversation_id)
+    except (TypeError, ValueError, UnicodeError) as e:
+        raise ValueError(f"Invalid cursor: {cursor}") from e
+
+
+class ConversationStore:
+    """Database-backed conversations with a hot LRU cache and write-behind persistence.
+
+    Reads are served from the cache, which is revalidated against the row's updated_at so
+    that writes made by other workers are picked up. Writes update the cached object
+    immediately and are queued; a single background thread applies them in batches, so
+    request handlers (and streaming turns) never wait on the database. Messages are
+    only ever inserted, never rewritten.
+
+    Anything that reads the database blocks, so async handlers use the a* variants,
+    which run it in a worker thread instead of on the event loop.
+    """
+
+    def __init__(
+        self,
+        session_factory,
+        conversation_cls,
+        message_cls,
+        cache_size: int = 1000,
+        batch_size: int = 200,
+        validate_cache: bool = True,
+        write_retries: int = 3,
+    ):
+        self.session_factory = session_factory
+        self.conversation_cls = conversation_cls
+        self.message_cls = message_cls
+        self.cache_size = cache_size
+        self.batch_size = batch_size
+        self.validate_cache = validate_cache
+        self.write_retries = write_retries
+        self._cache: "OrderedDict[str, object]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._writes: "queue.Queue" = queue.Queue()
+        # Writes are numbered as they are queued; the writer publishes how many it has finished
+        self._written = threading.Condition()
+        self._enqueued_count = 0
+        self._applied_count = 0
+        self._writer = threading.Thread(target=self._write_loop, name="conversation-writer", daemon=True)
+        self._writer.start()
+
+    # Cache helpers
+
+    def _cache_put(self, conversation) -> None:
+        with self._lock:
+            self._cache[conversation.conversation_id] = conversation
+            self._cache.move_to_end(conversation.conversation_id)
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+
+    def _cache_get(self, conversation_id: str):
+        with self._lock:
+            conversation = self._cache.get(conversation_id)
+            if conversation is not None:
+                self._cache.move_to_end(conversation_id)
+            return conversation
+
+    # Write-behind
+
+    def _enqueue(self, operation: str, payload: dict) -> None:
+        with self._written:
+            self._enqueued_count += 1
+            self._writes.put((operation, payload))
+
+    def _write_loop(self) -> None:
+        while True:
+            batch = [self._writes.get()]
+            while len(batch) < self.batch_size:
+                try:
+                    batch.append(self._writes.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                self._persist(batch)
+            finally:
+                with self._written:
+                    self._applied_count += len(batch)
+                    self._written.notify_all()
+
+    def _persist(self, batch) -> None:
+        """Apply a batch, retrying transient failures; never drops writes silently."""
+        for attempt in range(1, self.write_retries + 1):
+            try:
+                self._apply(batch)
+                return
+            except Exception as e:
+                logger.warning(
+                    f"Persisting {len(batch)} conversation writes failed (attempt {attempt}/{self.write_retries}): {str(e)}"
+                )
+                time.sleep(0.1 * 2 ** attempt)
+
+        # Still failing: isolate the bad writes so the rest of the batch is kept
+        for write in batch:
+            try:
+                self._apply([write])
+            except Exception as e:
+                conversation_id = write[1].get("conversation_id") or write[1].get("id")
+                logger.error(
+                    f"Dropped {write[0]} write for conversation {conversation_id}: {str(e)}; "
+                    f"evicting it from the cache so reads go back to the database"
+                )
+                with self._lock:
+                    self._cache.pop(conversation_id, None)
+
+    def _apply(self, batch) -> None:
+        """Apply a batch of queued writes in one transaction, in the order they were made."""
+        with self.session_factory() as session:
+            for operation, payload in batch:
+                if operation == "create":
+                    session.merge(Conversation(**payload))
+                elif operation == "message":
+                    session.add(Message(**payload["message"]))
+                    session.execute(
+                        update(Conversation)
+                        .where(Conversation.id == payload["conversation_id"])
+                        .values(**payload["meta"])
+                    )
+                elif operation == "meta":
+                    session.execute(
+                        update(Conversation)
+                        .where(Conversation.id == payload["conversation_id"])
+                        .values(**payload["meta"])
+                    )
+                elif operation == "delete":
+                    session.execute(delete(Message).where(Message.conversation_id == payload["conversation_id"]))
+                    session.execute(delete(Conversation).where(Conversation.id == payload["conversation_id"]))
+                # Flush each step so a message insert never precedes its conversation row
+                session.flush()
+            session.commit()
+
+    def flush(self) -> None:
+        """Block until the writes queued before this call have been applied.
+
+        Writes queued afterwards are not waited for, so steady traffic can't hold a reader
+        here indefinitely. Never call this on the event loop.
+        """
+        with self._written:
+            target = self._enqueued_count
+            self._written.wait_for(lambda: self._applied_count >= target)
+
+    @staticmethod
+    def _meta(conversation) -> dict:
+        return {
+            "summary": conversation.summary,
+            "history_summary": conversation.history_summary,
+            "history_summarized_upto": conversation.history_summarized_upto,
+            "message_count": len(conversation.messages),
+            "updated_at": conversation.updated_at,
+        }
+
+    # Public API
+
+    def create(self, conversation) -> None:
+        self._cache_put(conversation)
+        self._enqueue("create", {
+            "id": conversation.conversation_id,
+            "created_at": conversation.created_at,
+            **self._meta(conversation),
+        })
+
+    def append_message(self, conversation, message) -> None:
+        """Persist a message that was just appended to conversation.messages."""
+        self._cache_put(conversation)
+        self._enqueue("message", {
+            "conversation_id": conversation.conversation_id,
+            "message": {
+                "message_id": message.message_id,
+                "conversation_id": conversation.conversation_id,
+                "role": message.role,
+                "content": message.content,
+                "created_at": message.created_at,
+            },
+            "meta": self._meta(conversation),
+        })
+
+    def save_metadata(self, conversation) -> None:
+        """Persist summary / history summary / updated_at changes."""
+        self._cache_put(conversation)
+        self._enqueue("meta", {"conversation_id": conversation.conversation_id, "meta": self._meta(conversation)})
+
+    def delete(self, conversation_id: str) -> bool:
+        """Delete a conversation; returns False if it does not exist."""
+        if self.get(conversation_id) is None:
+            return False
+        with self._lock:
+            self._cache.pop(conversation_id, None)
+        self._enqueue("delete", {"conversation_id": conversation_id})
+        return True
+
+    def get(self, conversation_id: str):
+        """Return the conversation, from the cache when it is still current."""
+        cached = self._cache_get(conversation_id)
+        if cached is not None and not self.validate_cache:
+            return cached
+
+        if cached is not None:
+            with self.session_factory() as session:
+                stored_updated_at = session.execute(
+                    select(Conversation.updated_at).where(Conversation.id == conversation_id)
+                ).scalar_one_or_none()
+            # Our cached copy is ahead of (or equal to) the database unless another worker wrote
+            if stored_updated_at is None or stored_updated_at <= cached.updated_at:
+                return cached
+
+        # Make sure our own queued writes are visible before reading the database
+        self.flush()
+        with self.session_factory() as session:
+            row = session.execute(
+                select(Conversation)
+                .options(selectinload(Conversation.messages))
+                .where(Conversation.id == conversation_id)
+            ).scalar_one_or_none()
+            if row is None:
+                return None
+            conversation = self._from_row(row)
+        self._cache_put(conversation)
+        return conversation
+
+    def _from_row(self, row):
+        return self.conversation_cls(
+            conversation_id=row.id,
+            summary=row.summary,
+            created_at=row.created_at,
+            updated_at=row.updated_at,
+            history_summary=row.history_summary,
+            history_summarized_upto=row.history_summarized_upto or 0,
+            messages=[
+                self.message_cls(
+                    message_id=message.message_id,
+                    role=message.role,
+                    content=message.content,
+                    created_at=message.created_at,
+                )
+                for message in row.messages
+            ],
+        )
+
+    def all_conversations(self):
+        """Every conversation with its messages (used by the sidebar listing)."""
+        self.flush()
+        with self.session_factory() as session:
+            rows = session.execute(
+                select(Conversation).options(selectinload(Conversation.messages))
+            ).scalars().all()
+            return [self._from_row(row) for row in rows]
+
+    def list_page(
+        self,
+        limit: int = 50,
+        cursor: Optional[str] = None,
+    ) -> Tuple[List[dict], Optional[str]]:
+        """One page of conversation metadata, most recently updated first.
+
+        Only the conversations table is read (no messages). Returns the rows and the cursor
+        of the next page, or None when this is the last one.
+        """
+        # Read-your-writes: a conversation created a moment ago should be listed
+        self.flush()
+        query = select(
+            Conversation.id,
+            Conversation.summary,
+            Conversation.message_count,
+            Conversation.created_at,
+            Conversation.updated_at,
+        )
+        if cursor:
+            updated_at, conversation_id = decode_cursor(cursor)
+            query = query.where(or_(
+                Conversation.updated_at < updated_at,
+                and_(Conversation.updated_at == updated_at, Conversation.id < conversation_id),
+            ))
+        query = query.order_by(Conversation.updated_at.desc(), Conversation.id.desc()).limit(limit + 1)
+
+        with self.session_factory() as session:
+            rows = session.execute(query).all()
+
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1].updated_at, rows[-1].id)
+        page = [
+            {
+                "_id": row.id,
+                "summary": row.summary or "",
+                "message_count": row.message_count,
+                "created_at": row.created_at,
+                "updated_at": row.updated_at,
+            }
+            for row in rows
+        ]
+        return page, next_cursor
+
+    # Async API: the blocking reads (and the flush before them) run in a worker thread
+
+    async def aget(self, conversation_id: str):
+        return await asyncio.to_thread(self.get, conversation_id)
+
+    async def adelete(self, conversation_id: str) -> bool:
+        return await asyncio.to_thread(self.delete, conversation_id)
+
+    async def aall_conversations(self):
+        return await asyncio.to_thread(self.all_conversations)
+
+    async def alist_page(self, limit: int = 50, cursor: Optional[str] = None) -> Tuple[List[dict], Optional[str]]:
+        return await asyncio.to_thread(self.list_page, limit, cursor)
@@ -0,0 +1,124 @@
+import os
+from functools import lru_cache
+from typing import Optional
+
+from sqlalchemy import create_engine, event
+from sqlalchemy.engine import make_url
+from sqlalchemy.orm import sessionmaker
+
+from logger import logger
+
+
+DATABASE_URL = os.getenv("DATABASE_URL", "sqlite:///./users.db")
+DB_POOL_SIZE = int(os.getenv("DB_POOL_SIZE", 10))
+DB_MAX_OVERFLOW = int(os.getenv("DB_MAX_OVERFLOW", 20))
+DB_POOL_TIMEOUT = float(os.getenv("DB_POOL_TIMEOUT", 30))
+DB_POOL_RECYCLE = int(os.getenv("DB_POOL_RECYCLE", 1800))
+
+# Async drivers used when an async engine is requested for a sync URL
+ASYNC_DRIVERS = {
+    "sqlite": "sqlite+aiosqlite",
+    "postgresql": "postgresql+asyncpg",
+    "mysql": "mysql+aiomysql",
+}
+
+
+def _is_sqlite(url: str) -> bool:
+    return make_url(url).get_backend_name() == "sqlite"
+
+
+def _enable_sqlite_wal(engine) -> None:
+    """WAL lets readers proceed while a write is in progress; NORMAL sync is safe with WAL."""
+    @event.listens_for(engine, "connect")
+    def set_sqlite_pragmas(dbapi_connection, connection_record):
+        cursor = dbapi_connection.cursor()
+        cursor.execute("PRAGMA journal_mode=WAL")
+        cursor.execute("PRAGMA synchronous=NORMAL")
+        cursor.execute("PRAGMA busy_timeout=5000")
+        cursor.execute("PRAGMA foreign_keys=ON")
+        cursor.close()
+
+
+def _engine_kwargs(url: str) -> dict:
+    if _is_sqlite(url):
+        # Pooled connections are handed to FastAPI's worker threads
+        return {"connect_args": {"check_same_thread": False}}
+    return {
+        "pool_size": DB_POOL_SIZE,
+        "max_overflow": DB_MAX_OVERFLOW,
+        "pool_timeout": DB_POOL_TIMEOUT,
+        "pool_recycle": DB_POOL_RECYCLE,
+        "pool_pre_ping": True,
+    }
+
+
+# The cached builders are keyed on the resolved URL, so get_engine() and get_engine(DATABASE_URL)
+# share one engine (and one connection pool)
+
+@lru_cache(maxsize=None)
+def _engine_for(url: str):
+    engine = create_engine(url, **_engine_kwargs(url))
+    if _is_sqlite(url):
+        _enable_sqlite_wal(engine)
+    logger.info(f"Database engine ready for {make_url(url).render_as_string(hide_password=True)}")
+    return engine
+
+
+def get_engine(url: Optional[str] = None):
+    """Process-wide engine (and connection pool) for url, DATABASE_URL by default."""
+    return _engine_for(url or DATABASE_URL)
+
+
+@lru_cache(maxsize=None)
+def _sessionmaker_for(url: str):
+    return sessionmaker(bind=_engine_for(url), autocommit=False, autoflush=False, expire_on_commit=False)
+
+
+def get_sessionmaker(url: Optional[str] = None):
+    return _sessionmaker_for(url or DATABASE_URL)
+
+
+@lru_cache(maxsize=None)
+def _async_engine_for(url: str):
+    from sqlalchemy.ext.asyncio import create_async_engine
+
+    parsed = make_url(url)
+    backend = parsed.get_backend_name()
+    if backend in ASYNC_DRIVERS and parsed.drivername == backend:
+        parsed = parsed.set(drivername=ASYNC_DRIVERS[backend])
+    async_url = parsed.render_as_string(hide_password=False)
+    engine = create_async_engine(async_url, **_engine_kwargs(url))
+    if _is_sqlite(url):
+        _enable_sqlite_wal(engine.sync_engine)
+    return engine
+
+
+def get_async_engine(url: Optional[str] = None):
+    """Async engine for the same database; needs the matching async driver (aiosqlite, asyncpg, ...)."""
+    return _async_engine_for(url or DATABASE_URL)
+
+
+@lru_cache(maxsize=None)
+def _async_sessionmaker_for(url: str):
+    from sqlalchemy.ext.asyncio import async_sessionmaker
+
+    return async_sessionmaker(bind=_async_engine_for(url), autoflush=False, expire_on_commit=False)
+
+
+def get_async_sessionmaker(url: Optional[str] = None):
+    return _async_sessionmaker_for(url or DATABASE_URL)
+
+
+def get_db():
+    """Database session generator"""
+    db = get_sessionmaker()()
+    try:
+        yield db
+    finally:
+        db.close()
+
+
+async def get_async_db():
+    """Async database session generator"""
+    async with get_async_sessionmaker()() as db:
+        yield db
@@ -0,0 +1,252 @@
+import asyncio
+import json
+import os
+import sqlite3
+import threading
+from typing import Any, Dict, Iterator, List, Optional, Sequence, Tuple
+
+from langchain_core.stores import BaseStore
+from langchain.storage import InMemoryStore
+
+from logger import logger
+
+
+# SQLite caps the number of bound parameters per statement, so batched reads are chunked.
+SQLITE_BATCH_SIZE = 500
+
+
+def _encode_value(value: Any) -> Tuple[str, bytes]:
+    """Serialize a docstore value into (kind, payload)."""
+    if isinstance(value, bytes):
+        return "bytes", value
+    if isinstance(value, str):
+        return "str", value.encode("utf-8")
+    if isinstance(value, dict) and isinstance(value.get("content"), (bytes, bytearray)):
+        # Tagged binary entries (images): JSON header line, then the raw bytes untouched
+        header = {key: item for key, item in value.items() if key != "content"}
+        return "entry", json.dumps(header).encode("utf-8") + b"\n" + bytes(value["content"])
+    return "json", json.dumps(value).encode("utf-8")
+
+
+def _decode_value(kind: str, payload: bytes) -> Any:
+    """Inverse of _encode_value."""
+    if kind == "bytes":
+        return bytes(payload)
+    if kind == "str":
+        return bytes(payload).decode("utf-8")
+    if kind == "entry":
+        # json.dumps never emits a raw newline, so the first one ends the header
+        header, content = bytes(payload).split(b"\n", 1)
+        return {**json.loads(header.decode("utf-8")), "content": content}
+    return json.loads(bytes(payload).decode("utf-8"))
+
+
+class LazyBlob:
+    """Handle to the raw bytes of a binary entry that are still in the docstore.
+
+    len() is known without touching the payload; read() fetches just those bytes.
+    """
+
+    def __init__(self, store: "SQLiteDocStore", key: str, offset: int, size: int):
+        self.store = store
+        self.key = key
+        self.offset = offset
+        self.size = size
+
+    def __len__(self) -> int:
+        return self.size
+
+    def read(self) -> bytes:
+        row = self.store._connection().execute(
+            "SELECT substr(value, ?, ?) FROM docstore WHERE key = ?", (self.offset + 1, self.size, self.key)
+        ).fetchone()
+        if row is None:
+            raise KeyError(f"Docstore entry {self.key} was deleted before its payload was read")
+        return bytes(row[0])
+
+
+def load_payloads(entries: List[Any]) -> List[Any]:
+    """Replace LazyBlob contents with their bytes; call once the entries to use are chosen."""
+    return [
+        {**entry, "content": entry["content"].read()}
+        if isinstance(entry, dict) and isinstance(entry.get("content"), LazyBlob) else entry
+        for entry in entries
+    ]
+
+
+class SQLiteDocStore(BaseStore[str, Any]):
+    """Durable docstore backed by a single SQLite file.
+
+    The database runs in WAL mode so any number of uvicorn workers on the same host can
+    read while one of them writes. mget returns complete values; mget_lazy returns binary
+    entries (images) with a LazyBlob in place of their bytes, so candidates can be
+    selected by header and size and only the survivors' payloads are read.
+
+    Every write or delete of a key bumps its generation in doc_generations, in the same
+    transaction. Caches in any worker compare generations to notice that a document they
+    used was re-ingested or deleted elsewhere.
+    """
+
+    def __init__(self, db_path: str, mmap_size: int = 256 * 1024 * 1024, batch_size: int = SQLITE_BATCH_SIZE):
+        self.db_path = db_path
+        self.mmap_size = mmap_size
+        self.batch_size = batch_size
+        self._local = threading.local()
+
+        directory = os.path.dirname(os.path.abspath(db_path))
+        os.makedirs(directory, exist_ok=True)
+
+        conn = self._connection()
+        with conn:
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS docstore (
+                       key TEXT PRIMARY KEY,
+                       kind TEXT NOT NULL,
+                       value BLOB NOT NULL
+                   )"""
+            )
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS doc_generations (
+                       key TEXT PRIMARY KEY,
+                       generation INTEGER NOT NULL
+                   ) WITHOUT ROWID"""
+            )
+        logger.info(f"SQLite docstore ready at {db_path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        """Return the connection owned by the calling thread."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            conn.execute(f"PRAGMA mmap_size={int(self.mmap_size)}")
+            self._local.conn = conn
+        return conn
+
+    def _batches(self, items: Sequence) -> Iterator[Sequence]:
+        for start in range(0, len(items), self.batch_size):
+            yield items[start:start + self.batch_size]
+
+    @staticmethod
+    def _bump_generations(conn: sqlite3.Connection, keys: Sequence[str]) -> None:
+        conn.executemany(
+            """INSERT INTO doc_generations (key, generation) VALUES (?, 1)
+               ON CONFLICT (key) DO UPDATE SET generation = generation + 1""",
+            [(key,) for key in keys],
+        )
+
+    def generations(self, keys: Sequence[str]) -> Dict[str, int]:
+        """Current generation of each key (0 if it was never written)."""
+        keys = list(keys)
+        found = {}
+        conn = self._connection()
+        for batch in self._batches(keys):
+            placeholders = ",".join("?" for _ in batch)
+            found.update(conn.execute(
+                f"SELECT key, generation FROM doc_generations WHERE key IN ({placeholders})", list(batch)
+            ))
+        return {key: found.get(key, 0) for key in keys}
+
+    def mget(self, keys: Sequence[str]) -> List[Optional[Any]]:
+        """Fetch many values with one query per batch, preserving the order of keys."""
+        keys = list(keys)
+        found = {}
+        conn = self._connection()
+        for batch in self._batches(keys):
+            placeholders = ",".join("?" for _ in batch)
+            rows = conn.execute(
+                f"SELECT key, kind, value FROM docstore WHERE key IN ({placeholders})",
+                list(batch),
+            )
+            for key, kind, payload in rows:
+                found[key] = _decode_value(kind, payload)
+        return [found.get(key) for key in keys]
+
+    def mget_lazy(self, keys: Sequence[str]) -> List[Optional[Any]]:
+        """Like mget, but binary entries carry a LazyBlob instead of their payload."""
+        keys = list(keys)
+        found = {}
+        conn = self._connection()
+        for batch in self._batches(keys):
+            placeholders = ",".join("?" for _ in batch)
+            # For binary entries only the JSON header (up to the first newline) leaves SQLite
+            rows = conn.execute(
+                f"""SELECT key, kind,
+                           CASE WHEN kind = 'entry' THEN substr(value, 1, instr(value, X'0A') - 1) ELSE value END,
+                           length(value)
+                    FROM docstore WHERE key IN ({placeholders})""",
+                list(batch),
+            )
+            for key, kind, payload, length in rows:
+                if kind != "entry":
+                    found[key] = _decode_value(kind, payload)
+                    continue
+                offset = len(payload) + 1
+                found[key] = {
+                    **json.loads(bytes(payload).decode("utf-8")),
+                    "content": LazyBlob(self, key, offset, length - offset),
+                }
+        return [found.get(key) for key in keys]
+
+    async def amget_lazy(self, keys: Sequence[str]) -> List[Optional[Any]]:
+        return await asyncio.to_thread(self.mget_lazy, keys)
+
+    def mset(self, key_value_pairs: Sequence[Tuple[str, Any]]) -> None:
+        """Write all pairs in a single transaction."""
+        rows = [(key, *_encode_value(value)) for key, value in key_value_pairs]
+        if not rows:
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            conn.executemany(
+                "INSERT OR REPLACE INTO docstore (key, kind, value) VALUES (?, ?, ?)",
+                rows,
+            )
+            self._bump_generations(conn, [row[0] for row in rows])
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def mdelete(self, keys: Sequence[str]) -> None:
+        """Delete the given keys in a single transaction."""
+        keys = list(keys)
+        if not keys:
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            for batch in self._batches(keys):
+                placeholders = ",".join("?" for _ in batch)
+                conn.execute(f"DELETE FROM docstore WHERE key IN ({placeholders})", list(batch))
+            self._bump_generations(conn, keys)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def yield_keys(self, prefix: Optional[str] = None) -> Iterator[str]:
+        """Iterate over stored keys, optionally restricted to a prefix."""
+        conn = self._connection()
+        if prefix:
+            escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+            rows = conn.execute(
+                "SELECT key FROM docstore WHERE key LIKE ? ESCAPE '\\'", (escaped + "%",)
+            )
+        else:
+            rows = conn.execute("SELECT key FROM docstore")
+        for (key,) in rows:
+            yield key
+
+
+def get_docstore(backend: Optional[str] = None, db_path: Optional[str] = None) -> BaseStore:
+    """Build the docstore selected by DOCSTORE_BACKEND ("sqlite" or "memory")."""
+    backend = (backend or os.getenv("DOCSTORE_BACKEND", "sqlite")).lower()
+    if backend == "memory":
+        # Process-local stand-in, only suitable for tests and single-worker development
+        return InMemoryStore()
+    if backend == "sqlite":
+        return SQLiteDocStore(db_path or os.getenv("DOCSTORE_PATH", "./docstore.db"))
+    raise ValueError(f"Unknown docstore backend: {backend}")
@@ -0,0 +1,99 @@
+import hashlib
+import threading
+from array import array
+from collections import OrderedDict
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.stores import BaseStore
+
+
+class CachedEmbeddings(Embeddings):
+    """Content-addressed cache in front of an embeddings model.
+
+    Vectors are keyed by sha256(model, kind, text), where kind separates document and
+    query embeddings (Gemini embeds them with different task types). Lookups go through
+    an in-memory LRU tier first and an optional persistent BaseStore tier second; only
+    the remaining misses are sent to the wrapped model, deduplicated and in one batch.
+    """
+
+    def __init__(self, underlying: Embeddings, disk_store: Optional[BaseStore] = None, max_memory_entries: int = 10_000):
+        self.underlying = underlying
+        self.disk_store = disk_store
+        self.max_memory_entries = max_memory_entries
+        self.model_name = str(getattr(underlying, "model", type(underlying).__name__))
+        self._memory: "OrderedDict[str, List[float]]" = OrderedDict()
+        self._lock = threading.Lock()
+        self._stats = {"memory_hits": 0, "disk_hits": 0, "misses": 0}
+
+    def _key(self, kind: str, text: str) -> str:
+        digest = hashlib.sha256()
+        for part in (self.model_name, kind, text):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _remember(self, key: str, vector: List[float]) -> None:
+        with self._lock:
+            self._memory[key] = vector
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _lookup(self, keys: List[str]) -> Dict[str, List[float]]:
+        """Resolve as many keys as possible from the memory tier, then the disk tier."""
+        found = {}
+        with self._lock:
+            for key in keys:
+                vector = self._memory.get(key)
+                if vector is not None:
+                    self._memory.move_to_end(key)
+                    found[key] = vector
+            self._stats["memory_hits"] += len(found)
+
+        missing = [key for key in keys if key not in found]
+        if missing and self.disk_store is not None:
+            for key, payload in zip(missing, self.disk_store.mget(missing)):
+                if payload is not None:
+                    vector = array("f", payload).tolist()
+                    found[key] = vector
+                    self._remember(key, vector)
+                    with self._lock:
+                        self._stats["disk_hits"] += 1
+        return found
+
+    def _embed(self, kind: str, texts: List[str]) -> List[List[float]]:
+        keys = [self._key(kind, text) for text in texts]
+        found = self._lookup(list(dict.fromkeys(keys)))
+
+        pending = {key: text for key, text in zip(keys, texts) if key not in found}
+        if pending:
+            with self._lock:
+                self._stats["misses"] += len(pending)
+            if kind == "query":
+                vectors = [self.underlying.embed_query(text) for text in pending.values()]
+            else:
+                vectors = self.underlying.embed_documents(list(pending.values()))
+            for key, vector in zip(pending, vectors):
+                vector = list(vector)
+                found[key] = vector
+                self._remember(key, vector)
+            if self.disk_store is not None:
+                self.disk_store.mset([(key, array("f", found[key]).tobytes()) for key in pending])
+
+        return [found[key] for key in keys]
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        return self._embed("document", list(texts))
+
+    def embed_query(self, text: str) -> List[float]:
+        return self._embed("query", [text])[0]
+
+    def stats(self) -> Dict[str, float]:
+        """Hit/miss counters for both tiers."""
+        with self._lock:
+            stats = dict(self._stats)
+            stats["memory_entries"] = len(self._memory)
+        lookups = stats["memory_hits"] + stats["disk_hits"] + stats["misses"]
+        stats["hit_rate"] = round((lookups - stats["misses"]) / lookups, 4) if lookups else 0.0
+        return stats
@@ -1,41 +1,130 @@
+import os
 import time
 import sys
 from pinecone import Pinecone, ServerlessSpec
+from langchain_core.embeddings import DeterministicFakeEmbedding
 from langchain_google_genai import GoogleGenerativeAIEmbeddings
 from langchain_pinecone import PineconeVectorStore
 from langchain.retrievers.multi_vector import MultiVectorRetriever
-from langchain.storage import InMemoryStore
 
 
+from docstore import SQLiteDocStore, get_docstore
+from embedding_cache import CachedEmbeddings
+from hybrid_retriever import HybridRetriever
+from lexical_index import BM25Index
+from local_vectorstore import LocalVectorStore
 from logger import logger
 
 
-def get_retriever(pinecone_api_key, index_name="test-medico-rag"):
-    """Set up Pinecone index and retriever."""
+EMBEDDING_DIMENSION = 768
+
+
+def get_embeddings():
+    """Embeddings selected by EMBEDDING_BACKEND ("google", or "fake" for offline CI).
+
+    Unless EMBEDDING_CACHE=off, the model is wrapped in a content-addressed cache with an
+    in-memory LRU tier and an on-disk tier at EMBEDDING_CACHE_PATH.
+    """
+    backend = os.getenv("EMBEDDING_BACKEND", "google").lower()
+    if backend == "fake":
+        embeddings = DeterministicFakeEmbedding(size=EMBEDDING_DIMENSION)
+    else:
+        embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+
+    if os.getenv("EMBEDDING_CACHE", "on").lower() == "off":
+        return embeddings
+    return CachedEmbeddings(
+        embeddings,
+        disk_store=SQLiteDocStore(os.getenv("EMBEDDING_CACHE_PATH", "./embedding_cache.db")),
+        max_memory_entries=int(os.getenv("EMBEDDING_CACHE_SIZE", 10_000)),
+    )
+
+
+def get_pinecone_vectorstore(pinecone_api_key, index_name, embeddings):
+    """Set up the Pinecone index and wrap it as a vector store."""
     pc = Pinecone(api_key=pinecone_api_key)
 
     existing_indexes = [index_info["name"] for index_info in pc.list_indexes()]
     if index_name not in existing_indexes:
         pc.create_index(
             name=index_name,
-            dimension=768,
+            dimension=EMBEDDING_DIMENSION,
             metric="cosine",
             spec=ServerlessSpec(cloud="aws", region="us-east-1"),
         )
-    
+
     # Wait until the index is ready
     while not pc.describe_index(index_name).status["ready"]:
         time.sleep(1)
 
     index = pc.Index(index_name)
-    embeddings = GoogleGenerativeAIEmbeddings(model="models/embedding-001")
+    return PineconeVectorStore(index=index, embedding=embeddings)
+
 
-    vector_store = PineconeVectorStore(index=index, embedding=embeddings)
-    doc_store = InMemoryStore()
+def get_local_vectorstore(index_name, embeddings):
+    """Set up the on-disk in-process vector store under VECTOR_INDEX_DIR."""
+    return LocalVectorStore(
+        embedding=embeddings,
+        persist_dir=os.path.join(os.getenv("VECTOR_INDEX_DIR", "./vector_index"), index_name),
+        dimension=EMBEDDING_DIMENSION,
+        index_type=os.getenv("VECTOR_INDEX_TYPE", "auto"),
+        ivf_threshold=int(os.getenv("VECTOR_IVF_THRESHOLD", 50_000)),
+        nprobe=int(os.getenv("VECTOR_IVF_NPROBE", 8)),
+    )
 
+
+def get_retriever(pinecone_api_key=None, index_name="test-medico-rag", vector_backend=None, k=None):
+    """Set up the vector store selected by VECTOR_BACKEND ("pinecone" or "local") and retriever.
+
+    With RETRIEVAL_MODE=hybrid (the default) vector hits are fused with a BM25 index kept
+    at BM25_INDEX_PATH; RETRIEVAL_MODE=vector uses the vector store alone. k defaults
+    to RETRIEVER_K.
+
+    Unless RETRIEVAL_FANOUT=off, text, tables and images are searched separately with
+    RETRIEVER_K_<MODALITY> results and RETRIEVER_BYTES_<MODALITY> bytes each. An explicit
+    k (the reranker's over-fetch) replaces the text and table counts.
+    """
+    vector_backend = (vector_backend or os.getenv("VECTOR_BACKEND", "pinecone")).lower()
+    embeddings = get_embeddings()
+
+    if vector_backend == "local":
+        vector_store = get_local_vectorstore(index_name, embeddings)
+    elif vector_backend == "pinecone":
+        vector_store = get_pinecone_vectorstore(pinecone_api_key, index_name, embeddings)
+    else:
+        raise ValueError(f"Unknown vector backend: {vector_backend}")
+    logger.info(f"Using {vector_backend} vector store for index {index_name}")
+
+    doc_store = get_docstore()
+    hybrid = os.getenv("RETRIEVAL_MODE", "hybrid").lower() == "hybrid"
+    fanout = os.getenv("RETRIEVAL_FANOUT", "on").lower() != "off"
+    modality_k = {
+        "text": k or int(os.getenv("RETRIEVER_K_TEXT", 3)),
+        "table": k or int(os.getenv("RETRIEVER_K_TABLE", 2)),
+        "image": int(os.getenv("RETRIEVER_K_IMAGE", 1)),
+    }
+    modality_bytes = {
+        "text": int(os.getenv("RETRIEVER_BYTES_TEXT", 32_000)),
+        "table": int(os.getenv("RETRIEVER_BYTES_TABLE", 32_000)),
+        "image": int(os.getenv("RETRIEVER_BYTES_IMAGE", 2_000_000)),
+    }
+    k = k or int(os.getenv("RETRIEVER_K", 3))
+
+    if hybrid or fanout:
+        return HybridRetriever(
+            vectorstore=vector_store,
+            docstore=doc_store,
+            id_key="doc_id",
+            lexical_index=BM25Index(os.getenv("BM25_INDEX_PATH", "./bm25_index.db")) if hybrid else None,
+            k=k,
+            candidates=int(os.getenv("HYBRID_CANDIDATES", 20)),
+            rrf_k=int(os.getenv("RRF_K", 60)),
+            modality_k=modality_k if fanout else None,
+            modality_bytes=modality_bytes,
+        )
     return MultiVectorRetriever(
         vectorstore=vector_store,
         docstore=doc_store,
         id_key="doc_id",
-        search_kwargs={"k": 3},
-    )
\ No newline at end of file
+        search_kwargs={"k": k},
+    )
@@ -0,0 +1,148 @@
+import asyncio
+from typing import Any, Dict, List, Optional
+
+from langchain.retrievers.multi_vector import MultiVectorRetriever
+from langchain_core.callbacks import (
+    AsyncCallbackManagerForRetrieverRun,
+    CallbackManagerForRetrieverRun,
+)
+
+from docstore import LazyBlob, load_payloads
+from lexical_index import BM25Index
+from rag_utils import IMAGE, TABLE, TEXT
+
+
+def reciprocal_rank_fusion(rankings: List[List[str]], rrf_k: int = 60) -> List[str]:
+    """Merge ranked id lists: each list contributes 1 / (rrf_k + rank) to an id's score."""
+    scores: Dict[str, float] = {}
+    for ranking in rankings:
+        for rank, doc_id in enumerate(ranking, start=1):
+            scores[doc_id] = scores.get(doc_id, 0.0) + 1.0 / (rrf_k + rank)
+    return sorted(scores, key=scores.get, reverse=True)
+
+
+def entry_modality(entry: Any) -> str:
+    return entry.get("modality", TEXT) if isinstance(entry, dict) else TEXT
+
+
+def entry_size(entry: Any) -> int:
+    content = entry.get("content", "") if isinstance(entry, dict) else entry
+    return len(content) if isinstance(content, (bytes, bytearray, LazyBlob)) else len(str(content).encode("utf-8"))
+
+
+class HybridRetriever(MultiVectorRetriever):
+    """MultiVectorRetriever that fuses vector search with a BM25 lexical index.
+
+    Both searches fetch `candidates` ids, the rankings are merged with reciprocal-rank
+    fusion and the top `k` documents are read from the docstore. Lexical matching catches
+    the drug names, codes and table values that dense embeddings tend to miss.
+
+    With `modality_k` set, the vector search fans out into one filtered query per modality
+    (run concurrently), and the result holds at most modality_k[m] entries and
+    modality_bytes[m] bytes of each modality, so large images can't crowd out text.
+    """
+
+    lexical_index: Optional[BM25Index] = None
+    k: int = 3
+    candidates: int = 20
+    rrf_k: int = 60
+    modality_k: Optional[Dict[str, int]] = None
+    modality_bytes: Dict[str, int] = {}
+
+    def _vector_ids(self, sub_docs) -> List[str]:
+        ids = []
+        for doc in sub_docs:
+            doc_id = doc.metadata.get(self.id_key)
+            if doc_id is not None and doc_id not in ids:
+                ids.append(doc_id)
+        return ids
+
+    def _lexical_ids(self, query: str) -> List[str]:
+        if self.lexical_index is None:
+            return []
+        return [doc_id for doc_id, _ in self.lexical_index.search(query, k=self.candidates)]
+
+    def _search_kwargs(self, modality: Optional[str] = None) -> dict:
+        if modality is None:
+            return {**self.search_kwargs, "k": self.candidates}
+        # Images are not in the lexical index; a small margin lets the byte budget skip oversized ones
+        k = 2 * self.modality_k[modality] if modality == IMAGE else max(self.candidates, self.modality_k[modality])
+        return {**self.search_kwargs, "k": k, "filter": {"modality": modality}}
+
+    def _fuse(self, vector_rankings: Dict[Optional[str], List[str]], lexical_ids: List[str]) -> List[str]:
+        if self.modality_k is None:
+            return reciprocal_rank_fusion([vector_rankings[None], lexical_ids], self.rrf_k)[:self.k]
+        return reciprocal_rank_fusion(list(vector_rankings.values()) + [lexical_ids], self.rrf_k)
+
+    def _select(self, docs: List[Any]) -> List[Any]:
+        """Apply the per-modality k and byte budgets, keeping the fused order within each modality."""
+        docs = [doc for doc in docs if doc is not None]
+        if self.modality_k is None:
+            return docs
+        selected: Dict[str, List[Any]] = {TEXT: [], TABLE: [], IMAGE: []}
+        used_bytes: Dict[str, int] = {}
+        for doc in docs:
+            modality = entry_modality(doc)
+            kept = selected.setdefault(modality, [])
+            if len(kept) >= self.modality_k.get(modality, self.k):
+                continue
+            size = entry_size(doc)
+            budget = self.modality_bytes.get(modality)
+            if budget and used_bytes.get(modality, 0) + size > budget:
+                continue
+            kept.append(doc)
+            used_bytes[modality] = used_bytes.get(modality, 0) + size
+        return [doc for kept in selected.values() for doc in kept]
+
+    def _fetch(self, ids: List[str]) -> List[Any]:
+        """Entries for the fused ids; image payloads are only read for the entries selected."""
+        if not hasattr(self.docstore, "mget_lazy"):
+            return self._select(self.docstore.mget(ids))
+        return load_payloads(self._select(self.docstore.mget_lazy(ids)))
+
+    async def _afetch(self, ids: List[str]) -> List[Any]:
+        if not hasattr(self.docstore, "amget_lazy"):
+            return self._select(await self.docstore.amget(ids))
+        selected = self._select(await self.docstore.amget_lazy(ids))
+        return await asyncio.to_thread(load_payloads, selected)
+
+    def _modalities(self) -> List[Optional[str]]:
+        return list(self.modality_k) if self.modality_k is not None else [None]
+
+    def _get_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: CallbackManagerForRetrieverRun,
+    ) -> List[Any]:
+        vector_rankings = {
+            modality: self._vector_ids(self.vectorstore.similarity_search(query, **self._search_kwargs(modality)))
+            for modality in self._modalities()
+        }
+        if self.modality_k is not None and not any(vector_rankings.values()):
+            # Vectors ingested before modality metadata existed only show up unfiltered
+            vector_rankings[None] = self._vector_ids(self.vectorstore.similarity_search(query, **self._search_kwargs()))
+        fused = self._fuse(vector_rankings, self._lexical_ids(query))
+        return self._fetch(fused)
+
+    async def _aget_relevant_documents(
+        self,
+        query: str,
+        *,
+        run_manager: AsyncCallbackManagerForRetrieverRun,
+    ) -> List[Any]:
+        modalities = self._modalities()
+        # Every vector query and the SQLite-bound BM25 lookup run at once, so latency is the slowest one
+        *sub_doc_lists, lexical_ids = await asyncio.gather(
+            *(self.vectorstore.asimilarity_search(query, **self._search_kwargs(modality)) for modality in modalities),
+            asyncio.to_thread(self._lexical_ids, query),
+        )
+        vector_rankings = {
+            modality: self._vector_ids(sub_docs) for modality, sub_docs in zip(modalities, sub_doc_lists)
+        }
+        if self.modality_k is not None and not any(vector_rankings.values()):
+            vector_rankings[None] = self._vector_ids(
+                await self.vectorstore.asimilarity_search(query, **self._search_kwargs())
+            )
+        fused = self._fuse(vector_rankings, lexical_ids)
+        return await self._afetch(fused)
@@ -0,0 +1,108 @@
+import base64
+import io
+import os
+import threading
+from collections import OrderedDict
+from typing import Optional, Tuple
+
+from logger import logger
+
+try:
+    from PIL import Image
+except ImportError:  # Pillow is optional; without it images are only size-checked
+    Image = None
+
+
+PROMPT_IMAGE_MAX_SIDE = int(os.getenv("PROMPT_IMAGE_MAX_SIDE", 1024))
+PROMPT_IMAGE_MAX_BYTES = int(os.getenv("PROMPT_IMAGE_MAX_BYTES", 512 * 1024))
+PROMPT_IMAGE_CACHE_SIZE = int(os.getenv("PROMPT_IMAGE_CACHE_SIZE", 256))
+
+
+class _PreparedImageCache:
+    """Small thread-safe LRU of prompt-ready images keyed by doc_id."""
+
+    def __init__(self, max_entries: int):
+        self.max_entries = max_entries
+        self._entries: "OrderedDict[str, Optional[Tuple[str, str]]]" = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key: str):
+        with self._lock:
+            if key not in self._entries:
+                return False, None
+            self._entries.move_to_end(key)
+            return True, self._entries[key]
+
+    def put(self, key: str, value: Optional[Tuple[str, str]]) -> None:
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_entries:
+                self._entries.popitem(last=False)
+
+
+_prepared_images = _PreparedImageCache(PROMPT_IMAGE_CACHE_SIZE)
+
+
+def _to_bytes(content) -> bytes:
+    if isinstance(content, (bytes, bytearray, memoryview)):
+        return bytes(content)
+    return base64.b64decode(content)
+
+
+def _reencode(raw: bytes, max_side: int, max_bytes: int) -> Optional[bytes]:
+    """Downscale to max_side and re-encode as JPEG, shrinking further until under max_bytes."""
+    image = Image.open(io.BytesIO(raw))
+    if image.mode not in ("RGB", "L"):
+        image = image.convert("RGB")
+    image.thumbnail((max_side, max_side))
+    for _ in range(6):
+        for quality in (85, 70, 55):
+            buffer = io.BytesIO()
+            image.save(buffer, format="JPEG", quality=quality, optimize=True)
+            if buffer.tell() <= max_bytes:
+                return buffer.getvalue()
+        image = image.resize((max(1, int(image.width * 0.75)), max(1, int(image.height * 0.75))))
+    return None
+
+
+def prepare_image(
+    content,
+    mime_type: str = "image/jpeg",
+    doc_id: Optional[str] = None,
+    max_side: int = PROMPT_IMAGE_MAX_SIDE,
+    max_bytes: int = PROMPT_IMAGE_MAX_BYTES,
+) -> Optional[Tuple[str, str]]:
+    """Return (base64, mime_type) of an image that fits the prompt limits, or None if it can't.
+
+    Results are cached per doc_id, so an image is only downscaled the first time it is retrieved.
+    """
+    if doc_id is not None:
+        hit, cached = _prepared_images.get(doc_id)
+        if hit:
+            return cached
+
+    prepared = None
+    try:
+        raw = _to_bytes(content)
+        if Image is not None:
+            with Image.open(io.BytesIO(raw)) as probe:
+                fits = max(probe.size) <= max_side and len(raw) <= max_bytes
+        else:
+            fits = len(raw) <= max_bytes
+
+        if fits:
+            encoded = content if isinstance(content, str) else base64.b64encode(raw).decode("utf-8")
+            prepared = (encoded, mime_type)
+        elif Image is not None:
+            shrunk = _reencode(raw, max_side, max_bytes)
+            if shrunk is not None:
+                prepared = (base64.b64encode(shrunk).decode("utf-8"), "image/jpeg")
+    except Exception as e:
+        logger.error(f"Could not prepare image {doc_id} for the prompt: {str(e)}")
+
+    if prepared is None:
+        logger.warning(f"Dropping image {doc_id} from the prompt, it does not fit in {max_bytes} bytes")
+    if doc_id is not None:
+        _prepared_images.put(doc_id, prepared)
+    return prepared
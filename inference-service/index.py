@@ -1,16 +1,21 @@
 # index.py
-from fastapi import FastAPI, HTTPException, Depends, status, Response, Request, Path, Body
+from fastapi import FastAPI, HTTPException, Depends, status, Response, Request, Path, Body, Query, Form, File, UploadFile
 from fastapi.security import OAuth2PasswordRequestForm
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import StreamingResponse
+from fastapi.responses import JSONResponse, StreamingResponse
 from sqlalchemy.orm import Session
 from sqlalchemy import desc
-from pydantic import BaseModel
+from pydantic import BaseModel, PrivateAttr
 import asyncio
-from typing import List, Optional, Dict
+import base64
+import contextlib
+import hashlib
+import json
+from typing import Any, Dict, List, Literal, Optional, Tuple
 import os
 import uuid
 import sys
+import time
 import uvicorn
 from dotenv import load_dotenv
 from langchain_core.documents import Document
@@ -24,7 +29,33 @@ from datetime import datetime, timedelta
 
 from get_llm import get_llm
 from get_db import get_retriever
-from rag_utils import encode_image, prompt_func, split_image_text_types
+from rag_utils import (
+    CONTEXT_TOKEN_BUDGET,
+    IMAGE,
+    TABLE,
+    TEXT,
+    encode_image,
+    estimate_tokens,
+    guess_image_mime_type,
+    prompt_func,
+    split_image_text_types,
+    summarize_history,
+    tag_entry
+)
+from chain_registry import ChainRegistry
+from answer_cache import SemanticAnswerCache, replay_chunks, retrieved_doc_ids
+from conversation_store import ConversationStore
+from ingestion import embed_in_batches, upsert_embeddings
+from reranker import get_reranker, rerank
+from stream_protocol import (
+    MEDIA_TYPES as STREAM_MEDIA_TYPES,
+    TEXT as STREAM_TEXT,
+    TokenCoalescer,
+    accumulate_usage,
+    encode_event,
+    message_text,
+    negotiate_format,
+)
 from logger import logger
 
 
@@ -34,7 +65,7 @@ from auth import (
     create_access_token, 
     get_current_user, 
     get_db, 
-    get_password_hash, 
+    password_hasher, 
     UserCreate,
     UserLogin,
     RefreshTokenRequest,
@@ -44,14 +75,18 @@ from auth import (
 )
 
 # Create database tables
-from sqlalchemy import create_engine
-engine = create_engine(os.getenv("DATABASE_URL", "sqlite:///./users.db"))
+from database import get_engine, get_sessionmaker
+engine = get_engine()
 Base.metadata.create_all(bind=engine)
 
 
 # Load environment variables
 load_dotenv()
 ACCESS_TOKEN_EXPIRE_MINUTES = 35
+# Chat history sent to the LLM: the last HISTORY_MAX_TURNS turns verbatim within
+# HISTORY_TOKEN_BUDGET, everything older folded into a rolling summary
+HISTORY_MAX_TURNS = int(os.getenv("HISTORY_MAX_TURNS", 6))
+HISTORY_TOKEN_BUDGET = int(os.getenv("HISTORY_TOKEN_BUDGET", 2000))
 # Initialize FastAPI app
 app = FastAPI()
 origins = [
@@ -81,6 +116,24 @@ class ImageRequest(BaseModel):
     image_b64_list: List[str]
     image_summaries: List[str]
 
+class IngestElement(BaseModel):
+    type: Literal["text", "table", "image"]
+    # Image content is base64 in JSON batches; multipart batches name the file part instead
+    content: Optional[str] = None
+    file: Optional[str] = None
+    # Indexed instead of the content for tables and images
+    summary: Optional[str] = None
+    page: Optional[int] = None
+    mime_type: Optional[str] = None
+
+class IngestBatchRequest(BaseModel):
+    elements: List[IngestElement]
+    # Where the elements came from, e.g. {"fileId": ..., "fileName": ...}
+    source: Dict[str, Any] = {}
+
+class DeleteDocumentsRequest(BaseModel):
+    doc_ids: List[str]
+
 class QuestionRequest(BaseModel):
     question: str
 
@@ -96,30 +149,84 @@ class ChatConversation(BaseModel):
     created_at: Optional[datetime] = None
     updated_at: Optional[datetime] = None
     messages: List[Message] = []
-
-    def add_user_message(self, content: str):
+    # Rolling summary of messages[:history_summarized_upto], kept up to date in the background
+    history_summary: Optional[str] = None
+    history_summarized_upto: int = 0
+    _summary_lock: asyncio.Lock = PrivateAttr(default_factory=asyncio.Lock)
+
+    def _window_start(self, end: int, max_turns: int = HISTORY_MAX_TURNS, token_budget: int = HISTORY_TOKEN_BUDGET) -> int:
+        """Index of the oldest of messages[:end] kept verbatim within max_turns and token_budget."""
+        start = end
+        oldest = max(0, end - 2 * max_turns) if max_turns > 0 else end
+        while start > oldest:
+            cost = estimate_tokens(self.messages[start - 1].content)
+            if cost > token_budget:
+                break
+            token_budget -= cost
+            start -= 1
+        return start
+
+    async def prompt_history(self) -> Tuple[List[Message], Optional[str]]:
+        """(verbatim window, summary) for the current question, with no turns missing in between.
+
+        Messages between the summary and the window are normally folded in by the background
+        refresh after the previous answer. If that is still running or has failed, wait for it
+        (or redo it) now; should it fail again, they are sent verbatim rather than dropped.
+        """
+        end = len(self.messages) - 1
+        start = self._window_start(end)
+        if self.history_summarized_upto < start:
+            await self.refresh_history_summary(upto=start)
+        start = min(start, self.history_summarized_upto)
+        return self.messages[start:end], self.history_summary
+
+    async def refresh_history_summary(self, upto: Optional[int] = None):
+        """Fold messages that have left the verbatim window into the rolling summary.
+
+        By default this covers every message the next turn's window won't include.
+        """
+        async with self._summary_lock:
+            target = self._window_start(len(self.messages)) if upto is None else upto
+            if target <= self.history_summarized_upto:
+                return
+            try:
+                new_messages = self.messages[self.history_summarized_upto:target]
+                self.history_summary = await summarize_history(
+                    chain_registry.llm(streaming=False), self.history_summary, new_messages
+                )
+                self.history_summarized_upto = target
+                conversation_store.save_metadata(self)
+                logger.info(f"Updated history summary for {self.conversation_id} up to message {target}")
+            except Exception as e:
+                logger.error(f"Error summarizing history for {self.conversation_id}: {str(e)}")
+
+    def add_user_message(self, content: str) -> Message:
         """Add a user message to the conversation."""
-        self.messages.append(Message(
+        message = Message(
             message_id=str(uuid.uuid4()),  # Add a unique ID
             role="user", 
             content=content, 
             created_at=datetime.now()
-        ))
+        )
+        self.messages.append(message)
         self.updated_at = datetime.now()
+        return message
 
-    def add_ai_message(self, content: str):
+    def add_ai_message(self, content: str) -> Message:
         """Add an AI message to the conversation."""
-        self.messages.append(Message(
+        message = Message(
             message_id=str(uuid.uuid4()),  # Add a unique ID
             role="assistant", 
             content=content, 
             created_at=datetime.now()
-        ))
+        )
+        self.messages.append(message)
         self.updated_at = datetime.now()
 
         # Update summary if not set or if it's too short
         if not self.summary or len(self.summary) < 100:
             self.summary = content[:100]
+        return message
 
 class ChatRequest(BaseModel):
     conversation_id: Optional[str] = None
@@ -136,17 +243,54 @@ class ChatRequestGenerateStream(BaseModel):
 class TestRequest(BaseModel):
     some_text: str
 
-chat_conversations: Dict[str, ChatConversation] = {}
+# Conversations live in the database; hot ones are cached in memory and written behind
+conversation_store = ConversationStore(
+    session_factory=get_sessionmaker(),
+    conversation_cls=ChatConversation,
+    message_cls=Message,
+    cache_size=int(os.getenv("CONVERSATION_CACHE_SIZE", 1000))
+)
+# Strong references to fire-and-forget tasks so they aren't garbage collected mid-run
+background_tasks = set()
+
+def run_in_background(coroutine):
+    task = asyncio.create_task(coroutine)
+    background_tasks.add(task)
+    task.add_done_callback(background_tasks.discard)
 
 # Initialize retriever
+vector_backend = os.getenv("VECTOR_BACKEND", "pinecone").lower()
 pinecone_api_key = os.getenv("PINECONE_API_KEY")
-if not pinecone_api_key:
+if vector_backend == "pinecone" and not pinecone_api_key:
     logger.error("PINECONE_API_KEY not set.")
     sys.exit(1)
 else:
     logger.info("API SET")
     
-retriever = get_retriever(pinecone_api_key=pinecone_api_key)
+# With a reranker the retriever over-fetches RERANK_CANDIDATES and the reranker keeps the best RERANK_TOP_K
+reranker = get_reranker()
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", 12))
+RERANK_TOP_K = int(os.getenv("RERANK_TOP_K", 3))
+RERANK_TOKEN_BUDGET = int(os.getenv("RERANK_TOKEN_BUDGET", CONTEXT_TOKEN_BUDGET))
+retriever = get_retriever(
+    pinecone_api_key=pinecone_api_key,
+    vector_backend=vector_backend,
+    k=RERANK_CANDIDATES if reranker is not None else None
+)
+# BM25 index fed by the insert endpoints when hybrid retrieval is enabled
+lexical_index = getattr(retriever, "lexical_index", None)
+# LLM clients and the RAG chain are built once and shared by every request
+chain_registry = ChainRegistry(llm_factory=get_llm)
+
+@app.on_event("startup")
+async def warm_up_llm():
+    if os.getenv("LLM_WARMUP", "on").lower() != "off":
+        run_in_background(chain_registry.warm_up())
+    else:
+        chain_registry.rag_chain(streaming=True)
+
+# Answers to stand-alone questions, reused when the same documents come back for a similar question
+answer_cache = SemanticAnswerCache() if os.getenv("ANSWER_CACHE", "on").lower() != "off" else None
 
 
 @app.post("/api/conversation/create")
@@ -160,7 +304,7 @@ async def create_chat_conversation():
             updated_at=datetime.now(),
             messages=[]
         )
-        chat_conversations[conversation_id] = conversation
+        conversation_store.create(conversation)
         logger.info(f"Created new chat conversation: {conversation_id}")
         return {"conversation_id": conversation_id}
     except Exception as e:
@@ -171,19 +315,75 @@ async def create_chat_conversation():
 async def get_chat_history(conversation_id: str):
     """Retrieve chat history for a conversation."""
     try:
-        if conversation_id not in chat_conversations:
+        conversation = await conversation_store.aget(conversation_id)
+        if conversation is None:
             raise HTTPException(status_code=404, detail="Chat session not found")
         
-        return chat_conversations[conversation_id]
+        return conversation
     except Exception as e:
         logger.error(f"Error retrieving chat history: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
 
+def date_bucket(timestamp: datetime, now: datetime) -> str:
+    """Sidebar group (today / yesterday / last7Days / beforeThat) for a timestamp."""
+    days_diff = (now - timestamp).days
+    if days_diff == 0:
+        return "today"
+    elif days_diff == 1:
+        return "yesterday"
+    elif days_diff < 7:
+        return "last7Days"
+    return "beforeThat"
+
+@app.get("/api/conversations")
+async def list_conversations(
+    request: Request,
+    limit: int = Query(50, ge=1, le=200),
+    cursor: Optional[str] = None
+):
+    """Paginated conversation metadata (no messages), most recently updated first.
+
+    Responses carry an ETag over the page contents; a matching If-None-Match gets a 304.
+    """
+    try:
+        page, next_cursor = await conversation_store.alist_page(limit=limit, cursor=cursor)
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+    except Exception as e:
+        logger.error(f"Error listing chat conversations: {str(e)}")
+        raise HTTPException(status_code=500, detail=f"Internal server error: {str(e)}")
+
+    # The today / yesterday / ... grouping depends on the current date, so it is part of the tag
+    now = datetime.now()
+    fingerprint = hashlib.sha256(json.dumps(
+        [[item["_id"], item["summary"], item["message_count"], item["updated_at"].isoformat()] for item in page]
+        + [next_cursor, now.date().isoformat()],
+    ).encode("utf-8")).hexdigest()
+    etag = f'W/"{fingerprint[:32]}"'
+    headers = {"ETag": etag, "Cache-Control": "private, no-cache"}
+    if etag in [tag.strip() for tag in request.headers.get("if-none-match", "").split(",")]:
+        return Response(status_code=304, headers=headers)
+
+    # Bucketed by updated_at so the groups stay in the same order as the pages
+    grouped_conversations = {"today": [], "yesterday": [], "last7Days": [], "beforeThat": []}
+    for item in page:
+        grouped_conversations[date_bucket(item["updated_at"], now)].append({
+            **item,
+            "created_at": item["created_at"].isoformat(),
+            "updated_at": item["updated_at"].isoformat(),
+        })
+
+    return JSONResponse(
+        content={"conversations": grouped_conversations, "count": len(page), "next_cursor": next_cursor},
+        headers=headers
+    )
+
 @app.get("/api/newwww")
 async def get_chat_history_list():
     """Retrieve list of existing chat conversations grouped by date."""
     try:
-        logger.info(f"Retrieving all chat conversations: {chat_conversations}")
+        conversations = await conversation_store.aall_conversations()
+        logger.info(f"Retrieving all chat conversations: {len(conversations)}")
         
         # Prepare grouping data structure matching frontend interface
         grouped_conversations = {
@@ -195,7 +395,7 @@ async def get_chat_history_list():
         
         now = datetime.now()
         
-        for conversation in chat_conversations.values():
+        for conversation in conversations:
             # if not conversation or not conversation.messages:
             #     logger.warning(f"Skipping conversation {conversation.conversation_id} due to invalid history")
             #     continue
@@ -218,15 +418,7 @@ async def get_chat_history_list():
             }
             
             # Group conversations
-            days_diff = (now - conversation.created_at).days
-            if days_diff == 0:
-                grouped_conversations["today"].append(conversation_dict)
-            elif days_diff == 1:
-                grouped_conversations["yesterday"].append(conversation_dict)
-            elif days_diff < 7:
-                grouped_conversations["last7Days"].append(conversation_dict)
-            else:
-                grouped_conversations["beforeThat"].append(conversation_dict)
+            grouped_conversations[date_bucket(conversation.created_at, now)].append(conversation_dict)
         
         logger.info(f"Retrieved conversations: {sum(len(group) for group in grouped_conversations.values())} total")
         return {
@@ -241,10 +433,9 @@ async def get_chat_history_list():
 async def delete_chat_session(conversation_id: str):
     """Delete a chat conversation."""
     try:
-        if conversation_id not in chat_conversations:
+        if not await conversation_store.adelete(conversation_id):
             raise HTTPException(status_code=404, detail="Chat conversation not found")
         
-        del chat_conversations[conversation_id]
         logger.info(f"Deleted chat conversation: {conversation_id}")
         return {"status": "success", "message": "Chat conversation deleted"}
     except Exception as e:
@@ -257,11 +448,16 @@ async def insert_text(request: TextRequest):
     try:
         doc_ids = [str(uuid.uuid4()) for _ in request.texts]
         documents = [
-            Document(page_content=text, metadata={"doc_id": doc_ids[i]})
+            Document(page_content=text, metadata={"doc_id": doc_ids[i], "modality": TEXT})
             for i, text in enumerate(request.texts)
         ]
         retriever.vectorstore.add_documents(documents)
-        retriever.docstore.mset(list(zip(doc_ids, request.texts)))
+        retriever.docstore.mset([
+            (doc_id, tag_entry(text, TEXT, doc_id=doc_id))
+            for doc_id, text in zip(doc_ids, request.texts)
+        ])
+        if lexical_index is not None:
+            lexical_index.add(zip(doc_ids, request.texts))
         logger.info(f"Successfully inserted {len(request.texts)} texts")
         return {"status": "success", "inserted": len(request.texts)}
     except Exception as e:
@@ -280,11 +476,20 @@ async def insert_table(request: TableRequest):
         
         table_ids = [str(uuid.uuid4()) for _ in request.tables]
         documents = [
-            Document(page_content=summary, metadata={"doc_id": table_ids[i]})
+            Document(page_content=summary, metadata={"doc_id": table_ids[i], "modality": TABLE})
             for i, summary in enumerate(request.table_summaries)
         ]
         retriever.vectorstore.add_documents(documents)
-        retriever.docstore.mset(list(zip(table_ids, request.tables)))
+        retriever.docstore.mset([
+            (table_id, tag_entry(table, TABLE, doc_id=table_id))
+            for table_id, table in zip(table_ids, request.tables)
+        ])
+        if lexical_index is not None:
+            # Cell values are what lexical search is best at, so the table itself is indexed too
+            lexical_index.add(
+                (table_id, f"{summary}\n{table}")
+                for table_id, summary, table in zip(table_ids, request.table_summaries, request.tables)
+            )
         logger.info(f"Successfully inserted {len(request.tables)} tables")
         return {"status": "success", "inserted": len(request.tables)}
     except Exception as e:
@@ -303,11 +508,15 @@ async def insert_image(request: ImageRequest):
             
         img_ids = [str(uuid.uuid4()) for _ in request.image_b64_list]
         documents = [
-            Document(page_content=summary, metadata={"doc_id": img_ids[i]})
+            Document(page_content=summary, metadata={"doc_id": img_ids[i], "modality": IMAGE})
             for i, summary in enumerate(request.image_summaries)
         ]
         retriever.vectorstore.add_documents(documents)
-        retriever.docstore.mset(list(zip(img_ids, request.image_b64_list)))
+        images = [base64.b64decode(image_b64) for image_b64 in request.image_b64_list]
+        retriever.docstore.mset([
+            (img_id, tag_entry(image, IMAGE, mime_type=guess_image_mime_type(image), doc_id=img_id))
+            for img_id, image in zip(img_ids, images)
+        ])
         logger.info(f"Successfully inserted {len(request.image_b64_list)} images")
         return {"status": "success", "inserted": len(request.image_b64_list)}
     except Exception as e:
@@ -315,6 +524,135 @@ async def insert_image(request: ImageRequest):
         raise HTTPException(status_code=500, detail=str(e))
 
 
+async def ingest_elements(elements: List[IngestElement], source: Dict[str, Any], contents: List[Any]) -> List[str]:
+    """Embed, index and store elements whose payloads (str, or bytes for images) are in contents."""
+    missing_summaries = [
+        i for i, element in enumerate(elements)
+        if element.type != TEXT and not element.summary
+    ]
+    if missing_summaries:
+        raise HTTPException(
+            status_code=400,
+            detail=f"Tables and images need a summary (elements {missing_summaries})"
+        )
+    if not elements:
+        return []
+
+    doc_ids = [str(uuid.uuid4()) for _ in elements]
+    index_texts, metadatas, entries = [], [], []
+    for doc_id, element, content in zip(doc_ids, elements, contents):
+        index_texts.append(content if element.type == TEXT else element.summary)
+        metadata = {**source, "doc_id": doc_id, "modality": element.type, "page": element.page}
+        # Vector store metadata can't hold nulls
+        metadatas.append({key: value for key, value in metadata.items() if value is not None})
+        if element.type == IMAGE:
+            mime_type = element.mime_type or guess_image_mime_type(content)
+        else:
+            mime_type = element.mime_type or "text/plain"
+        entries.append((doc_id, tag_entry(content, element.type, mime_type=mime_type, doc_id=doc_id)))
+
+    started_at = time.perf_counter()
+    vectors = await embed_in_batches(retriever.vectorstore.embeddings, index_texts)
+    await asyncio.to_thread(upsert_embeddings, retriever.vectorstore, index_texts, vectors, metadatas, doc_ids)
+    # One docstore transaction for the whole batch
+    await asyncio.to_thread(retriever.docstore.mset, entries)
+    if lexical_index is not None:
+        await asyncio.to_thread(lexical_index.add, [
+            (doc_id, content if element.type == TEXT else f"{element.summary}\n{content}")
+            for doc_id, element, content in zip(doc_ids, elements, contents)
+            if element.type != IMAGE
+        ])
+
+    counts = {modality: sum(1 for e in elements if e.type == modality) for modality in (TEXT, TABLE, IMAGE)}
+    logger.info(
+        f"Ingested batch from {source.get('fileId', 'unknown source')}: {counts} "
+        f"in {(time.perf_counter() - started_at) * 1000:.1f} ms"
+    )
+    return doc_ids
+
+@app.post("/api/ingest/batch")
+async def ingest_batch(request: IngestBatchRequest):
+    """Insert a mixed batch of texts, tables and images in one round trip."""
+    try:
+        if any(element.content is None for element in request.elements):
+            raise HTTPException(status_code=400, detail="Every element needs content")
+        # Images are stored as raw bytes; base64 is only produced again if a prompt needs them
+        contents = [
+            base64.b64decode(element.content) if element.type == IMAGE else element.content
+            for element in request.elements
+        ]
+        doc_ids = await ingest_elements(request.elements, request.source, contents)
+        return {"status": "success", "inserted": len(doc_ids), "doc_ids": doc_ids}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error ingesting batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/ingest/batch/multipart")
+async def ingest_batch_multipart(
+    manifest: str = Form(...),
+    files: List[UploadFile] = File(default=[])
+):
+    """
+    Same as /api/ingest/batch, but images travel as binary file parts. The manifest is an
+    IngestBatchRequest in JSON whose image elements name their part in `file`.
+    """
+    try:
+        try:
+            request = IngestBatchRequest.model_validate_json(manifest)
+        except ValueError as e:
+            raise HTTPException(status_code=400, detail=f"Invalid manifest: {str(e)}")
+
+        parts = {upload.filename: upload for upload in files}
+        contents = []
+        for element in request.elements:
+            if element.type != IMAGE:
+                if element.content is None:
+                    raise HTTPException(status_code=400, detail="Text and table elements need content")
+                contents.append(element.content)
+            elif element.file in parts:
+                contents.append(await parts[element.file].read())
+            else:
+                raise HTTPException(status_code=400, detail=f"No file part named {element.file!r}")
+
+        doc_ids = await ingest_elements(request.elements, request.source, contents)
+        return {"status": "success", "inserted": len(doc_ids), "doc_ids": doc_ids}
+    except HTTPException:
+        raise
+    except Exception as e:
+        logger.error(f"Error ingesting multipart batch: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.post("/api/delete-documents")
+async def delete_documents(request: DeleteDocumentsRequest):
+    """Remove documents from the doc store (and vector store where supported)."""
+    try:
+        # The retriever skips vectors whose docstore entry is gone, so this alone hides them
+        retriever.docstore.mdelete(request.doc_ids)
+        if lexical_index is not None:
+            lexical_index.delete(request.doc_ids)
+        if hasattr(retriever.vectorstore, "delete_by_doc_id"):
+            retriever.vectorstore.delete_by_doc_id(request.doc_ids)
+        invalidated = answer_cache.invalidate_documents(request.doc_ids) if answer_cache is not None else 0
+        logger.info(f"Deleted {len(request.doc_ids)} documents, invalidated {invalidated} cached answers")
+        return {"status": "success", "deleted": len(request.doc_ids)}
+    except Exception as e:
+        logger.error(f"Error deleting documents: {str(e)}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+@app.get("/api/metrics")
+async def get_metrics():
+    """Cache and throughput counters for this worker."""
+    embeddings = retriever.vectorstore.embeddings
+    return {
+        "embedding_cache": embeddings.stats() if hasattr(embeddings, "stats") else None,
+        "password_hashing": password_hasher.stats(),
+        "answer_cache": answer_cache.stats() if answer_cache is not None else None,
+        "chains": chain_registry.stats(),
+    }
+
+
 @app.post("/api/test")
 async def test_fn(
     request: TestRequest,
@@ -381,17 +719,26 @@ async def test_fn(
 @app.post("/api/generate/stream")
 async def generate_stream(
     request: ChatRequestGenerateStream,
-    request_from_REST_API: Request
+    request_from_REST_API: Request,
+    format: Optional[str] = Query(None, description="text, sse or ndjson; defaults to the Accept header")
 ):
-    """Invoke the RAG pipeline to answer a question with streaming."""
+    """Invoke the RAG pipeline to answer a question with streaming.
+
+    Plain text streams the answer only. SSE and NDJSON stream typed events: "retrieval"
+    (source ids), "delta" (answer text), "error" and a final "done" with token usage.
+    """
+    try:
+        stream_format = negotiate_format(format, request_from_REST_API.headers.get("accept", ""))
+    except ValueError as e:
+        raise HTTPException(status_code=400, detail=str(e))
+
     try:
         # Get or create chat conversation
-        # logger.info(chat_conversations)
         logger.info(request.conversation_id)
         if request.conversation_id:
-            if request.conversation_id not in chat_conversations:
+            conversation = await conversation_store.aget(request.conversation_id)
+            if conversation is None:
                 raise HTTPException(status_code=404, detail="Chat session not found")
-            conversation = chat_conversations[request.conversation_id]
         else:
             # Create new conversation if not exists
             conversation_id = str(uuid.uuid4())
@@ -401,40 +748,162 @@ async def generate_stream(
                 updated_at=datetime.now(),
                 messages=[]
             )
-            chat_conversations[conversation_id] = conversation
+            conversation_store.create(conversation)
 
         request_prompt_to_llm = request.messages[-1].content
 
         # Add the new question to conversation
-        conversation.add_user_message(request_prompt_to_llm)
-
-        # Create the chat prompt with history context
-        messages = conversation.messages
-
-        # Define the chain
-        chain = (
-            {
-                "context": retriever | RunnableLambda(split_image_text_types),
-                "question": RunnablePassthrough(),
-                "chat_history": RunnableLambda(lambda _: messages[:-1])  # Exclude the current question
-            }
-            | RunnableLambda(lambda x: prompt_func(x, debug=True))
-            | get_llm(allow_streaming=True)
-            | StrOutputParser()
-        )
+        conversation_store.append_message(conversation, conversation.add_user_message(request_prompt_to_llm))
+
+        # Recent turns verbatim, older ones through the rolling summary
+        history, history_summary = await conversation.prompt_history()
+        # Follow-ups depend on the conversation, so only stand-alone questions use the answer cache
+        use_answer_cache = answer_cache is not None and not history and not history_summary
+
+        async def answer_stream():
+            """Retrieve, then replay a cached answer or stream a fresh one from the LLM, as events."""
+            docs = await retriever.ainvoke(request_prompt_to_llm)
+            if reranker is not None:
+                docs = await asyncio.to_thread(
+                    rerank, reranker, request_prompt_to_llm, docs, RERANK_TOP_K, RERANK_TOKEN_BUDGET
+                )
+            sources = [
+                {"doc_id": doc.get("doc_id"), "modality": doc.get("modality", TEXT)}
+                for doc in docs if isinstance(doc, dict)
+            ]
+            doc_ids = retrieved_doc_ids(docs) if use_answer_cache else None
+            question_vector = None
+            generations = None
+            if doc_ids:
+                question_vector = await retriever.vectorstore.embeddings.aembed_query(request_prompt_to_llm)
+                if hasattr(retriever.docstore, "generations"):
+                    # Shared across workers, so re-ingests and deletes made elsewhere are seen
+                    generations = await asyncio.to_thread(retriever.docstore.generations, doc_ids)
+                cached_answer = answer_cache.lookup(question_vector, doc_ids, generations)
+                if cached_answer is not None:
+                    logger.info(f"Answer cache hit for {conversation.conversation_id}")
+                    yield {"type": "retrieval", "sources": sources, "cached": True}
+                    for chunk in replay_chunks(cached_answer):
+                        yield {"type": "delta", "text": chunk}
+                    yield {"type": "usage", "usage": {"input_tokens": 0, "output_tokens": 0, "total_tokens": 0}}
+                    return
+            yield {"type": "retrieval", "sources": sources, "cached": False}
+
+            setup_started_at = time.perf_counter()
+            chain = chain_registry.rag_chain(streaming=True)
+            logger.info(f"Chain setup for {conversation.conversation_id}: {(time.perf_counter() - setup_started_at) * 1000:.3f} ms")
+            answer_chunks = []
+            usage = None
+            async for chunk in chain.astream(
+                {"question": request_prompt_to_llm, "docs": docs},
+                config={"configurable": {"chat_history": history, "history_summary": history_summary}}
+            ):
+                usage = accumulate_usage(usage, chunk)
+                token = message_text(chunk)
+                if token:
+                    answer_chunks.append(token)
+                    yield {"type": "delta", "text": token}
+            answer = "".join(answer_chunks)
+            if usage is None:
+                # Not every provider reports usage while streaming
+                usage = {"output_tokens": estimate_tokens(answer), "estimated": True}
+            yield {"type": "usage", "usage": usage}
+            # Only complete answers are cached; a disconnect never reaches this line
+            if question_vector is not None and answer:
+                answer_cache.put(request_prompt_to_llm, question_vector, doc_ids, answer, generations)
 
         async def generate_response():
-            """Async generator that streams AI response."""
-            async for token in chain.astream(request_prompt_to_llm):
-                yield token
-
-        # Add the AI response to conversation (use the full response for history purposes)
-        full_response = "".join([token async for token in generate_response()])
-        conversation.add_ai_message(full_response)
-
-        # Return streaming response
-        return StreamingResponse(generate_response(), media_type="text/plain")
-
+            """Frame the answer events, coalescing deltas, and record the answer in the history once done.
+
+            The body is pulled by the server one frame at a time, so a slow client slows the LLM
+            stream down instead of buffering the answer here. A client that goes away is noticed at
+            the next flush; closing answer_stream() then cancels the LLM call.
+            """
+            response_chunks = []
+            started_at = time.perf_counter()
+            first_token_at = None
+            usage = None
+            cached = False
+            coalescer = TokenCoalescer()
+            disconnected = False
+
+            def frame(event):
+                return encode_event(event, stream_format)
+
+            try:
+                async with contextlib.aclosing(answer_stream()) as events:
+                    async for event in events:
+                        if event["type"] == "retrieval":
+                            cached = event["cached"]
+                        elif event["type"] == "usage":
+                            usage = event["usage"]
+                            continue
+                        elif event["type"] == "delta":
+                            batch = coalescer.add(event["text"])
+                            if batch is None:
+                                continue
+                            event = {"type": "delta", "text": batch}
+                            if first_token_at is None:
+                                first_token_at = time.perf_counter()
+                                logger.info(
+                                    f"Time to first token for {conversation.conversation_id}: "
+                                    f"{(first_token_at - started_at) * 1000:.1f} ms"
+                                )
+                        if await request_from_REST_API.is_disconnected():
+                            disconnected = True
+                            break
+                        if event["type"] == "delta":
+                            response_chunks.append(event["text"])
+                        framed = frame(event)
+                        if framed is not None:
+                            yield framed
+                if disconnected:
+                    logger.info(f"Client disconnected, cancelled generation for {conversation.conversation_id}")
+                    return
+                batch = coalescer.flush()
+                if batch:
+                    if first_token_at is None:
+                        first_token_at = time.perf_counter()
+                    response_chunks.append(batch)
+                    yield frame({"type": "delta", "text": batch})
+                done = frame({
+                    "type": "done",
+                    "conversation_id": conversation.conversation_id,
+                    "cached": cached,
+                    "usage": usage,
+                    "ttft_ms": round((first_token_at - started_at) * 1000, 1) if first_token_at else None,
+                    "elapsed_ms": round((time.perf_counter() - started_at) * 1000, 1),
+                })
+                if done is not None:
+                    yield done
+            except Exception as e:
+                logger.error(f"Error while streaming response: {str(e)}")
+                if stream_format == STREAM_TEXT:
+                    raise
+                # Headers are already sent, so framed streams report the failure in-band
+                yield frame({"type": "error", "detail": str(e)})
+            finally:
+                # Runs when the stream is exhausted and when the client disconnects mid-answer,
+                # so the history keeps whatever was actually sent.
+                if response_chunks:
+                    conversation_store.append_message(
+                        conversation, conversation.add_ai_message("".join(response_chunks))
+                    )
+                    run_in_background(conversation.refresh_history_summary())
+                logger.info(
+                    f"Streamed {len(response_chunks)} chunks for {conversation.conversation_id} "
+                    f"in {(time.perf_counter() - started_at) * 1000:.1f} ms"
+                )
+
+        # Return streaming response; retrieval and the chain run exactly once, inside the stream
+        headers = {"X-Conversation-Id": conversation.conversation_id}
+        if stream_format != STREAM_TEXT:
+            # Keep proxies from buffering the event stream
+            headers.update({"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+        return StreamingResponse(generate_response(), media_type=STREAM_MEDIA_TYPES[stream_format], headers=headers)
+
+    except HTTPException:
+        raise
     except Exception as e:
         logger.error(f"Error generating response: {str(e)}")
         raise HTTPException(status_code=500, detail=str(e))
@@ -450,13 +919,14 @@ async def patch_conversation_summary(
 ):
     conversation_id = request_body.conversation_id
     summary = request_body.summary
-    if not chat_conversations or conversation_id not in chat_conversations:
+    conversation = await conversation_store.aget(conversation_id)
+    if conversation is None:
         raise HTTPException(status_code=404, detail="Chat session not found")
 
     # Update the summary of the specific conversation
-    conversation = chat_conversations[conversation_id]
     conversation.summary = summary
     conversation.updated_at = datetime.now()
+    conversation_store.save_metadata(conversation)
 
     return {"status": "success", "message": "Summary updated"}
 
@@ -465,11 +935,9 @@ async def patch_conversation_summary(
 async def delete_conversation (
     conversation_id: str
 ):
-    if conversation_id not in chat_conversations:
+    if not await conversation_store.adelete(conversation_id):
         raise HTTPException(status_code = 404, detail = "Chat Conversation not found. Try again")
 
-    del chat_conversations[conversation_id]
-
 
 
 
@@ -486,13 +954,15 @@ async def delete_conversation (
 
 # Auth Endpoints
 @app.post("/api/signup")
-def signup(user: UserCreate, db: Session = Depends(get_db)):
+async def signup(user: UserCreate, db: Session = Depends(get_db)):
     """User registration endpoint"""
     logger.info(f"Signup data received: {user.dict()}")
-    # Check if user already exists
-    existing_user = db.query(User).filter(
-        (User.username == user.username) | (User.email == user.email)
-    ).first()
+    # Check if user already exists (blocking queries run in a worker thread, off the event loop)
+    existing_user = await asyncio.to_thread(
+        lambda: db.query(User).filter(
+            (User.username == user.username) | (User.email == user.email)
+        ).first()
+    )
     
     if existing_user:
         raise HTTPException(
@@ -501,27 +971,30 @@ def signup(user: UserCreate, db: Session = Depends(get_db)):
         )
     
     # Create new user
-    hashed_password = get_password_hash(user.password)
+    hashed_password = await password_hasher.hash(user.password)
     db_user = User(
         username=user.username, 
         email=user.email, 
         hashed_password=hashed_password
     )
     
-    db.add(db_user)
-    db.commit()
-    db.refresh(db_user)
+    def save_user():
+        db.add(db_user)
+        db.commit()
+        db.refresh(db_user)
+
+    await asyncio.to_thread(save_user)
     
     return {"status": "success", "message": "User created successfully"}
 
 @app.post("/api/login", response_model=Token)
-def login(
+async def login(
     response: Response, 
     form_data: OAuth2PasswordRequestForm = Depends(), 
     db: Session = Depends(get_db)
 ):
     """User login endpoint with JWT access and refresh tokens in cookie"""
-    user = authenticate_user(db, form_data.username, form_data.password)
+    user = await authenticate_user(db, form_data.username, form_data.password)
     if not user:
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
@@ -0,0 +1,66 @@
+import asyncio
+import os
+from typing import List, Optional
+
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from logger import logger
+
+
+INGEST_EMBED_BATCH_SIZE = int(os.getenv("INGEST_EMBED_BATCH_SIZE", 100))
+INGEST_EMBED_CONCURRENCY = int(os.getenv("INGEST_EMBED_CONCURRENCY", 4))
+INGEST_UPSERT_BATCH_SIZE = int(os.getenv("INGEST_UPSERT_BATCH_SIZE", 100))
+
+
+def _batches(items: list, size: int):
+    for start in range(0, len(items), size):
+        yield items[start:start + size]
+
+
+async def embed_in_batches(
+    embeddings: Embeddings,
+    texts: List[str],
+    batch_size: int = INGEST_EMBED_BATCH_SIZE,
+    concurrency: int = INGEST_EMBED_CONCURRENCY,
+) -> List[List[float]]:
+    """Embed texts in batches of batch_size, at most `concurrency` batches in flight."""
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def embed(batch: List[str]) -> List[List[float]]:
+        async with semaphore:
+            return await embeddings.aembed_documents(batch)
+
+    results = await asyncio.gather(*(embed(batch) for batch in _batches(texts, batch_size)))
+    return [vector for batch in results for vector in batch]
+
+
+def upsert_embeddings(
+    vectorstore: VectorStore,
+    texts: List[str],
+    vectors: List[List[float]],
+    metadatas: List[dict],
+    ids: Optional[List[str]] = None,
+    batch_size: int = INGEST_UPSERT_BATCH_SIZE,
+) -> None:
+    """Write precomputed embeddings to the vector store in chunks of batch_size."""
+    for start in range(0, len(texts), batch_size):
+        end = start + batch_size
+        chunk_ids = ids[start:end] if ids else None
+        if hasattr(vectorstore, "add_embeddings"):
+            vectorstore.add_embeddings(texts[start:end], vectors[start:end], metadatas[start:end], chunk_ids)
+        elif hasattr(vectorstore, "index") and hasattr(vectorstore.index, "upsert"):
+            # Pinecone: upsert directly so the texts aren't embedded a second time
+            text_key = getattr(vectorstore, "_text_key", "text")
+            vectorstore.index.upsert(
+                vectors=[
+                    (vector_id, vector, {**metadata, text_key: text})
+                    for vector_id, vector, metadata, text in zip(
+                        chunk_ids, vectors[start:end], metadatas[start:end], texts[start:end]
+                    )
+                ],
+                namespace=getattr(vectorstore, "_namespace", None),
+            )
+        else:
+            logger.warning(f"{type(vectorstore).__name__} can't take precomputed embeddings, re-embedding")
+            vectorstore.add_texts(texts[start:end], metadatas[start:end], ids=chunk_ids)
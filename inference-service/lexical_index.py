@@ -0,0 +1,129 @@
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from typing import Iterable, List, Sequence, Tuple
+
+from logger import logger
+
+
+# Keeps drug names, ICD/lab codes and numbers with separators ("E11.9", "5-FU", "0.5mg") as one token
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+(?:[-./][a-z0-9]+)*")
+STOPWORDS = frozenset(
+    "a an and are as at be by for from has have in is it its of on or that the this to was were what "
+    "when where which who why with how do does did can".split()
+)
+
+
+def tokenize(text: str) -> List[str]:
+    return [token for token in TOKEN_PATTERN.findall(text.lower()) if token not in STOPWORDS]
+
+
+class BM25Index:
+    """Incrementally updated BM25 inverted index in a SQLite file.
+
+    Postings are (term, doc_id, tf) rows and document lengths live next to them, so adding
+    or removing a document only touches that document's rows. Like SQLiteDocStore it runs
+    in WAL mode, so every uvicorn worker on the host can share one index.
+    """
+
+    def __init__(self, db_path: str, k1: float = 1.5, b: float = 0.75):
+        self.db_path = db_path
+        self.k1 = k1
+        self.b = b
+        self._local = threading.local()
+
+        os.makedirs(os.path.dirname(os.path.abspath(db_path)), exist_ok=True)
+        conn = self._connection()
+        with conn:
+            conn.execute("CREATE TABLE IF NOT EXISTS documents (doc_id TEXT PRIMARY KEY, length INTEGER NOT NULL)")
+            conn.execute(
+                """CREATE TABLE IF NOT EXISTS postings (
+                       term TEXT NOT NULL,
+                       doc_id TEXT NOT NULL,
+                       tf INTEGER NOT NULL,
+                       PRIMARY KEY (term, doc_id)
+                   ) WITHOUT ROWID"""
+            )
+            conn.execute("CREATE INDEX IF NOT EXISTS postings_doc_id ON postings (doc_id)")
+        logger.info(f"BM25 index ready at {db_path}")
+
+    def _connection(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.db_path, timeout=30, isolation_level=None, check_same_thread=False)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    @staticmethod
+    def _delete(conn: sqlite3.Connection, doc_ids: Sequence[str]) -> None:
+        conn.executemany("DELETE FROM postings WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+        conn.executemany("DELETE FROM documents WHERE doc_id = ?", [(doc_id,) for doc_id in doc_ids])
+
+    def add(self, documents: Iterable[Tuple[str, str]]) -> None:
+        """Index (doc_id, text) pairs in one transaction; re-adding a doc_id replaces it."""
+        documents = list(documents)
+        if not documents:
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._delete(conn, [doc_id for doc_id, _ in documents])
+            for doc_id, text in documents:
+                counts = Counter(tokenize(text))
+                conn.execute(
+                    "INSERT INTO documents (doc_id, length) VALUES (?, ?)",
+                    (doc_id, sum(counts.values())),
+                )
+                conn.executemany(
+                    "INSERT INTO postings (term, doc_id, tf) VALUES (?, ?, ?)",
+                    [(term, doc_id, tf) for term, tf in counts.items()],
+                )
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def delete(self, doc_ids: Sequence[str]) -> None:
+        doc_ids = list(doc_ids)
+        if not doc_ids:
+            return
+        conn = self._connection()
+        conn.execute("BEGIN IMMEDIATE")
+        try:
+            self._delete(conn, doc_ids)
+            conn.execute("COMMIT")
+        except Exception:
+            conn.execute("ROLLBACK")
+            raise
+
+    def search(self, query: str, k: int = 20) -> List[Tuple[str, float]]:
+        """Top-k (doc_id, BM25 score) pairs for the query, best first."""
+        terms = list(dict.fromkeys(tokenize(query)))
+        if not terms:
+            return []
+        conn = self._connection()
+        doc_count, total_length = conn.execute("SELECT COUNT(*), COALESCE(SUM(length), 0) FROM documents").fetchone()
+        if not doc_count:
+            return []
+        avg_length = total_length / doc_count or 1.0
+
+        scores: Counter = Counter()
+        for term in terms:
+            rows = conn.execute(
+                """SELECT p.doc_id, p.tf, d.length
+                   FROM postings p JOIN documents d ON d.doc_id = p.doc_id
+                   WHERE p.term = ?""",
+                (term,),
+            ).fetchall()
+            if not rows:
+                continue
+            idf = math.log(1 + (doc_count - len(rows) + 0.5) / (len(rows) + 0.5))
+            for doc_id, tf, length in rows:
+                norm = tf + self.k1 * (1 - self.b + self.b * length / avg_length)
+                scores[doc_id] += idf * tf * (self.k1 + 1) / norm
+        return scores.most_common(k)
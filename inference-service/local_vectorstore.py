@@ -0,0 +1,326 @@
+import fcntl
+import json
+import os
+import threading
+import uuid
+from contextlib import contextmanager
+from typing import Any, Callable, Dict, Iterable, List, Optional, Tuple
+
+import numpy as np
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_core.vectorstores import VectorStore
+
+from logger import logger
+
+
+class LocalVectorStore(VectorStore):
+    """In-process cosine-similarity vector store persisted to a directory.
+
+    Vectors live in one contiguous float32 file (``vectors.f32``) that is memory-mapped
+    for search; every row is L2-normalised on insert so cosine similarity is a single
+    matrix-vector product. Document text, metadata and deletions are kept in an
+    append-only log (``records.jsonl``). Small corpora are searched brute force; once
+    the live row count reaches ``ivf_threshold`` an IVF index (k-means coarse quantiser)
+    is trained and only the ``nprobe`` closest lists are scanned.
+
+    Several processes may share one directory: appends are serialised with a file lock
+    and every search first picks up rows written by other processes.
+    """
+
+    VECTORS_FILE = "vectors.f32"
+    RECORDS_FILE = "records.jsonl"
+    LOCK_FILE = ".lock"
+
+    def __init__(
+        self,
+        embedding: Embeddings,
+        persist_dir: str,
+        dimension: int = 768,
+        id_key: str = "doc_id",
+        index_type: str = "auto",
+        ivf_threshold: int = 50_000,
+        nprobe: int = 8,
+    ):
+        if index_type not in ("auto", "flat", "ivf"):
+            raise ValueError(f"Unknown index type: {index_type}")
+        self._embedding = embedding
+        self.persist_dir = persist_dir
+        self.dimension = dimension
+        self.id_key = id_key
+        self.index_type = index_type
+        self.ivf_threshold = ivf_threshold
+        self.nprobe = nprobe
+
+        os.makedirs(persist_dir, exist_ok=True)
+        self._vectors_path = os.path.join(persist_dir, self.VECTORS_FILE)
+        self._records_path = os.path.join(persist_dir, self.RECORDS_FILE)
+        self._lock_path = os.path.join(persist_dir, self.LOCK_FILE)
+        for path in (self._vectors_path, self._records_path):
+            open(path, "ab").close()
+
+        self._lock = threading.RLock()
+        self._matrix = np.empty((0, dimension), dtype=np.float32)
+        self._ids: List[str] = []
+        self._texts: List[str] = []
+        self._metadatas: List[Dict[str, Any]] = []
+        self._alive = np.zeros(0, dtype=bool)
+        self._row_by_id: Dict[str, int] = {}
+        self._records_offset = 0
+
+        # IVF state, (re)built lazily from the live rows
+        self._centroids: Optional[np.ndarray] = None
+        self._row_lists = np.zeros(0, dtype=np.int32)
+        self._trained_rows = 0
+
+        self._sync()
+        logger.info(f"Local vector store loaded {len(self._row_by_id)} vectors from {persist_dir}")
+
+    @property
+    def embeddings(self) -> Embeddings:
+        return self._embedding
+
+    @contextmanager
+    def _file_lock(self):
+        with open(self._lock_path, "a") as lock_file:
+            fcntl.flock(lock_file, fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                fcntl.flock(lock_file, fcntl.LOCK_UN)
+
+    def _sync(self) -> None:
+        """Replay records appended since the last sync (by this or another process)."""
+        with self._lock:
+            if os.path.getsize(self._records_path) == self._records_offset:
+                return
+            with open(self._records_path, "rb") as f:
+                f.seek(self._records_offset)
+                lines = f.readlines()
+            alive = bytearray(self._alive.astype(np.uint8).tobytes())
+            consumed = 0
+            for line in lines:
+                if not line.endswith(b"\n"):
+                    break  # a writer is midway through this line; pick it up next time
+                consumed += len(line)
+                record = json.loads(line)
+                if "deleted" in record:
+                    row = self._row_by_id.pop(record["deleted"], None)
+                    if row is not None:
+                        alive[row] = 0
+                    continue
+                previous = self._row_by_id.get(record["id"])
+                if previous is not None:
+                    alive[previous] = 0
+                self._row_by_id[record["id"]] = len(self._ids)
+                self._ids.append(record["id"])
+                self._texts.append(record["text"])
+                self._metadatas.append(record["metadata"])
+                alive.append(1)
+            self._records_offset += consumed
+
+            rows = len(self._ids)
+            self._alive = np.frombuffer(bytes(alive), dtype=np.uint8).astype(bool)
+            self._matrix = (
+                np.memmap(self._vectors_path, dtype=np.float32, mode="r", shape=(rows, self.dimension))
+                if rows else np.empty((0, self.dimension), dtype=np.float32)
+            )
+
+    def add_texts(
+        self,
+        texts: Iterable[str],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> List[str]:
+        """Embed and append texts. Ids default to the metadata doc_id, so re-adding replaces."""
+        texts = list(texts)
+        if not texts:
+            return []
+        return self.add_embeddings(texts, self._embedding.embed_documents(texts), metadatas, ids)
+
+    def add_embeddings(
+        self,
+        texts: List[str],
+        embeddings: List[List[float]],
+        metadatas: Optional[List[dict]] = None,
+        ids: Optional[List[str]] = None,
+    ) -> List[str]:
+        """Append texts whose embeddings were already computed."""
+        if not texts:
+            return []
+        metadatas = metadatas or [{} for _ in texts]
+        if ids is None:
+            ids = [str(metadata.get(self.id_key) or uuid.uuid4()) for metadata in metadatas]
+
+        vectors = np.asarray(embeddings, dtype=np.float32)
+        if vectors.shape != (len(texts), self.dimension):
+            raise ValueError(f"Expected embeddings of shape {(len(texts), self.dimension)}, got {vectors.shape}")
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        vectors /= np.where(norms == 0, 1, norms)
+
+        with self._lock, self._file_lock():
+            self._sync()
+            first_row = len(self._ids)
+            with open(self._vectors_path, "r+b") as f:
+                # Drop rows orphaned by a writer that died before logging their records
+                f.truncate(first_row * self.dimension * 4)
+                f.seek(0, os.SEEK_END)
+                f.write(vectors.tobytes())
+            with open(self._records_path, "ab") as f:
+                for i, (doc_id, text, metadata) in enumerate(zip(ids, texts, metadatas)):
+                    record = {"row": first_row + i, "id": doc_id, "text": text, "metadata": metadata}
+                    f.write((json.dumps(record) + "\n").encode("utf-8"))
+            self._sync()
+            self._assign_to_lists()
+        return ids
+
+    def delete(self, ids: Optional[List[str]] = None, **kwargs: Any) -> Optional[bool]:
+        """Delete vectors by id (the doc_id unless explicit ids were given on insert)."""
+        if not ids:
+            return False
+        with self._lock, self._file_lock():
+            self._sync()
+            with open(self._records_path, "ab") as f:
+                for doc_id in ids:
+                    if doc_id in self._row_by_id:
+                        f.write((json.dumps({"deleted": doc_id}) + "\n").encode("utf-8"))
+            self._sync()
+        return True
+
+    def delete_by_doc_id(self, doc_ids: List[str]) -> Optional[bool]:
+        """Delete every vector whose metadata id_key is in doc_ids."""
+        wanted = set(doc_ids)
+        with self._lock:
+            self._sync()
+            ids = [
+                doc_id for doc_id, row in self._row_by_id.items()
+                if self._metadatas[row].get(self.id_key) in wanted
+            ]
+        return self.delete(ids)
+
+    def get_by_ids(self, ids: List[str]) -> List[Document]:
+        self._sync()
+        documents = []
+        for doc_id in ids:
+            row = self._row_by_id.get(doc_id)
+            if row is not None:
+                documents.append(Document(id=doc_id, page_content=self._texts[row], metadata=self._metadatas[row]))
+        return documents
+
+    def _use_ivf(self, live_rows: int) -> bool:
+        if self.index_type == "flat":
+            return False
+        if self.index_type == "ivf":
+            return live_rows > 0
+        return live_rows >= self.ivf_threshold
+
+    def _train_ivf(self) -> None:
+        """Train k-means centroids over the live rows and bucket every row."""
+        live = np.flatnonzero(self._alive)
+        nlist = max(1, int(np.sqrt(len(live))))
+        rng = np.random.default_rng(0)
+        sample = live if len(live) <= nlist * 256 else rng.choice(live, nlist * 256, replace=False)
+        data = np.asarray(self._matrix[np.sort(sample)])
+        centroids = data[rng.choice(len(data), nlist, replace=False)].copy()
+        for _ in range(10):
+            assignment = np.argmax(data @ centroids.T, axis=1)
+            for c in range(nlist):
+                members = data[assignment == c]
+                if len(members):
+                    centroid = members.mean(axis=0)
+                    centroids[c] = centroid / (np.linalg.norm(centroid) or 1)
+        self._centroids = centroids
+        self._row_lists = np.zeros(0, dtype=np.int32)
+        self._trained_rows = len(live)
+        self._assign_to_lists()
+        logger.info(f"Trained IVF index with {nlist} lists over {len(live)} vectors")
+
+    def _assign_to_lists(self) -> None:
+        """Bucket rows that are not yet in an IVF list into their closest centroid."""
+        if self._centroids is None:
+            return
+        first_row, rows = len(self._row_lists), len(self._ids)
+        if first_row >= rows:
+            return
+        block = np.asarray(self._matrix[first_row:rows])
+        self._row_lists = np.concatenate(
+            [self._row_lists, np.argmax(block @ self._centroids.T, axis=1).astype(np.int32)]
+        )
+
+    def _candidate_rows(self, query: np.ndarray) -> np.ndarray:
+        live_rows = len(self._row_by_id)
+        if not self._use_ivf(live_rows):
+            return np.flatnonzero(self._alive)
+        # Retrain once the corpus has doubled since the centroids were fitted
+        if self._centroids is None or live_rows > 2 * self._trained_rows:
+            self._train_ivf()
+        else:
+            self._assign_to_lists()
+        nprobe = min(self.nprobe, len(self._centroids))
+        closest = np.argpartition(-(self._centroids @ query), nprobe - 1)[:nprobe]
+        return np.flatnonzero(np.isin(self._row_lists, closest) & self._alive)
+
+    def similarity_search_with_score_by_vector(
+        self,
+        embedding: List[float],
+        k: int = 4,
+        filter: Optional[Dict[str, Any]] = None,
+        **kwargs: Any,
+    ) -> List[Tuple[Document, float]]:
+        """Return the k most similar live documents with their cosine similarity."""
+        query = np.asarray(embedding, dtype=np.float32)
+        query /= np.linalg.norm(query) or 1
+        with self._lock:
+            self._sync()
+            candidates = self._candidate_rows(query)
+            if filter:
+                candidates = np.array(
+                    [row for row in candidates
+                     if all(self._metadatas[row].get(key) == value for key, value in filter.items())],
+                    dtype=np.int64,
+                )
+            if len(candidates) == 0:
+                return []
+            scores = np.asarray(self._matrix[candidates]) @ query
+            top = min(k, len(candidates))
+            best = np.argpartition(-scores, top - 1)[:top]
+            best = best[np.argsort(-scores[best])]
+            return [
+                (
+                    Document(
+                        id=self._ids[candidates[i]],
+                        page_content=self._texts[candidates[i]],
+                        metadata=self._metadatas[candidates[i]],
+                    ),
+                    float(scores[i]),
+                )
+                for i in best
+            ]
+
+    def similarity_search_with_score(self, query: str, k: int = 4, **kwargs: Any) -> List[Tuple[Document, float]]:
+        return self.similarity_search_with_score_by_vector(self._embedding.embed_query(query), k=k, **kwargs)
+
+    def similarity_search_by_vector(self, embedding: List[float], k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score_by_vector(embedding, k=k, **kwargs)]
+
+    def similarity_search(self, query: str, k: int = 4, **kwargs: Any) -> List[Document]:
+        return [doc for doc, _ in self.similarity_search_with_score(query, k=k, **kwargs)]
+
+    def _select_relevance_score_fn(self) -> Callable[[float], float]:
+        # Scores are already cosine similarities, not distances
+        return lambda score: score
+
+    @classmethod
+    def from_texts(
+        cls,
+        texts: List[str],
+        embedding: Embeddings,
+        metadatas: Optional[List[dict]] = None,
+        persist_dir: str = "./vector_index",
+        **kwargs: Any,
+    ) -> "LocalVectorStore":
+        ids = kwargs.pop("ids", None)
+        store = cls(embedding=embedding, persist_dir=persist_dir, **kwargs)
+        store.add_texts(texts, metadatas=metadatas, ids=ids)
+        return store
@@ -1,2 +1,2 @@
 from .User import Base, User
-# from .Conversation import Conversation, Message
\ No newline at end of file
+from .Conversation import Conversation, Message
@@ -1,7 +1,8 @@
 import base64
+import os
 from langchain_core.documents import Document
 from langchain.schema.messages import HumanMessage, SystemMessage
-from langchain.prompts import ChatPromptTemplate
+from image_utils import prepare_image
 from logger import logger
 
 
@@ -10,46 +11,145 @@ def encode_image(image_path):
     with open(image_path, "rb") as image_file:
         return base64.b64encode(image_file.read()).decode('utf-8')
 
+# Modality tags stored with every docstore entry
+TEXT = "text"
+TABLE = "table"
+IMAGE = "image"
+
+# Rough token accounting for the context budget; Gemini bills a fixed amount per image
+CONTEXT_TOKEN_BUDGET = int(os.getenv("PROMPT_CONTEXT_TOKEN_BUDGET", 8000))
+IMAGE_PROMPT_TOKENS = 258
+
+SYSTEM_PROMPT = """You are a helpful AI assistant. You have access to texts, tables, and images. 
+                     Answer questions based on this context and previous conversation history. 
+                     If you cannot find the relevant information in the provided context, say so.
+                     When referencing images, tables, or text, be specific about which source you're using."""
+
+# Leading base64 characters of common image formats' magic bytes
+IMAGE_MIME_PREFIXES = {
+    "/9j/": "image/jpeg",
+    "iVBORw0KGgo": "image/png",
+    "R0lGOD": "image/gif",
+    "UklGR": "image/webp",
+}
+IMAGE_MAGIC_BYTES = {
+    b"\xff\xd8\xff": "image/jpeg",
+    b"\x89PNG\r\n\x1a\n": "image/png",
+    b"GIF8": "image/gif",
+    b"RIFF": "image/webp",
+}
+
+def guess_image_mime_type(image):
+    """Guess an image's MIME type from its magic bytes (raw bytes or base64 string)."""
+    if isinstance(image, (bytes, bytearray)):
+        for magic, mime_type in IMAGE_MAGIC_BYTES.items():
+            if image.startswith(magic):
+                return mime_type
+        return "image/jpeg"
+    for prefix, mime_type in IMAGE_MIME_PREFIXES.items():
+        if image.startswith(prefix):
+            return mime_type
+    return "image/jpeg"
+
+def tag_entry(content, modality, mime_type="text/plain", doc_id=None):
+    """Wrap a docstore payload with its modality so retrieval never has to sniff it."""
+    return {"modality": modality, "mime_type": mime_type, "content": content, "doc_id": doc_id}
+
+def estimate_tokens(text):
+    """Cheap token estimate (~4 characters per token)."""
+    return len(text) // 4 + 1
+
 def split_image_text_types(docs):
-    """Split base64-encoded images and texts."""
-    b64, text = [], []
+    """Split retrieved entries into texts, tables and images by their modality tag."""
+    split = {"texts": [], "tables": [], "images": []}
     for doc in docs:
-        try:
-            base64.b64decode(doc)
-            b64.append(doc)
-        except Exception:
-            text.append(doc)
-    return {"images": b64, "texts": text}
-
-def prompt_func(inputs: dict, debug: bool) -> str:
-    """Create a prompt that incorporates context, chat history, and the current question."""
-    if debug:
-        print(dict)
+        if isinstance(doc, dict) and "modality" in doc:
+            modality, content = doc["modality"], doc["content"]
+        else:
+            # Untagged legacy entries are treated as plain text
+            modality, content = TEXT, doc
+        if modality == IMAGE:
+            # Images keep their tag so the prompt builder knows the MIME type and doc_id
+            split["images"].append(doc)
+        elif modality == TABLE:
+            split["tables"].append(content)
+        else:
+            split["texts"].append(content)
+    return split
+
+def message_role(msg):
+    """Prompt label for a history message (pydantic Message or langchain message)."""
+    if isinstance(msg, HumanMessage) or getattr(msg, "role", None) in ("user", "human"):
+        return "Human"
+    return "Assistant"
+
+def format_history(messages):
+    return "".join(f"{message_role(msg)}: {msg.content}\n" for msg in messages)
+
+async def summarize_history(llm, previous_summary, new_messages):
+    """Fold new_messages into previous_summary with one LLM call and return the updated summary."""
+    prompt = (
+        "You maintain a running summary of a conversation between a user and an AI assistant. "
+        "Update the summary with the new messages. Keep facts, names, numbers and open questions; "
+        "stay under 200 words.\n\n"
+        f"Current summary:\n{previous_summary or '(empty)'}\n\n"
+        f"New messages:\n{format_history(new_messages)}\n"
+        "Updated summary:"
+    )
+    response = await llm.ainvoke([HumanMessage(content=prompt)])
+    return response.content.strip()
+
+def fit_to_budget(items, budget, cost):
+    """Keep items, in order, while their cost fits in the remaining budget."""
+    kept = []
+    for item in items:
+        item_cost = cost(item)
+        if item_cost > budget:
+            continue
+        kept.append(item)
+        budget -= item_cost
+    return kept, budget
+
+def prompt_func(inputs: dict, debug: bool, token_budget: int = CONTEXT_TOKEN_BUDGET) -> list:
+    """Create the prompt messages that incorporate context, chat history, and the current question.
+
+    Texts and tables go into the user message as plain text; images are attached as
+    separate image_url parts (downscaled, data URIs) rather than inlined base64 text.
+    Context is trimmed to token_budget, texts first, then tables, then images.
+    """
     # Extract inputs
     context = inputs["context"]
     question = inputs["question"]
     chat_history = inputs.get("chat_history", [])
-    
+    history_summary = inputs.get("history_summary")
+
+    texts, budget = fit_to_budget(context.get("texts", []), token_budget, estimate_tokens)
+    tables, budget = fit_to_budget(context.get("tables", []), budget, estimate_tokens)
+    images = []
+    for image in context.get("images", []):
+        if budget < IMAGE_PROMPT_TOKENS:
+            break
+        prepared = prepare_image(image["content"], image.get("mime_type", "image/jpeg"), image.get("doc_id"))
+        if prepared is not None:
+            images.append(prepared)
+            budget -= IMAGE_PROMPT_TOKENS
+
     # Split context types if they exist
-    text_content = context.get("texts", "No relevant text content found")
-    table_content = context.get("tables", "No relevant table content found")
-    image_content = context.get("images", "No relevant image content found")
+    text_content = "\n\n".join(texts) or "No relevant text content found"
+    table_content = "\n\n".join(tables) or "No relevant table content found"
+    image_content = (
+        f"{len(images)} image(s) are attached below, in order." if images
+        else "No relevant image content found"
+    )
     
     # Format chat history
     history_str = ""
+    if history_summary:
+        history_str = f"\nSummary of the earlier conversation:\n{history_summary}\n"
     if chat_history:
-        history_str = "\nPrevious conversation:\n"
-        for msg in chat_history:
-            role = "Human" if isinstance(msg, HumanMessage) else "Assistant"
-            history_str += f"{role}: {msg.content}\n"
+        history_str += "\nPrevious conversation:\n" + format_history(chat_history)
     
-    # Create the prompt template
-    template = ChatPromptTemplate.from_messages([
-        ("system", """You are a helpful AI assistant. You have access to texts, tables, and images. 
-                     Answer questions based on this context and previous conversation history. 
-                     If you cannot find the relevant information in the provided context, say so.
-                     When referencing images, tables, or text, be specific about which source you're using."""),
-        ("user", f"""Here is the available context:
+    user_text = f"""Here is the available context:
 
                     Text Content:
                     {text_content}
@@ -64,12 +164,20 @@ def prompt_func(inputs: dict, debug: bool) -> str:
                     Current Question: {question}
                     
                     Please provide a clear and specific answer based on the above context and conversation history.
-                    If you reference any specific piece of content, indicate which source you're using.""")
-    ])
-    
+                    If you reference any specific piece of content, indicate which source you're using."""
+
+    # Messages are built directly (not through a prompt template), so braces in the
+    # retrieved content can never be mistaken for template variables
+    user_content = [{"type": "text", "text": user_text}]
+    for image_b64, mime_type in images:
+        user_content.append({"type": "image_url", "image_url": {"url": f"data:{mime_type};base64,{image_b64}"}})
+
     if debug:
-        logger.info(f"Context - Text: {(text_content)}, Tables: {(table_content)}, Images: {(image_content)}")
-        logger.info(f"Chat History Present: {(chat_history)}")
+        logger.info(
+            f"Context - Texts: {len(texts)}, Tables: {len(tables)}, Images: {len(images)}, "
+            f"Tokens used: {token_budget - budget}/{token_budget}"
+        )
+        logger.info(f"Chat History Present: {bool(chat_history)}")
         logger.info(f"Question: {question}")
     
-    return template
\ No newline at end of file
+    return [SystemMessage(content=SYSTEM_PROMPT), HumanMessage(content=user_content)]
@@ -0,0 +1,93 @@
+import os
+from typing import Any, List, Optional
+
+from lexical_index import tokenize
+from logger import logger
+from rag_utils import IMAGE, estimate_tokens
+
+
+RERANKER_MODEL = os.getenv("RERANKER_MODEL", "cross-encoder/ms-marco-MiniLM-L-6-v2")
+RERANKER_BATCH_SIZE = int(os.getenv("RERANKER_BATCH_SIZE", 16))
+
+
+class LexicalOverlapReranker:
+    """Deterministic fallback: fraction of query terms present in the passage."""
+
+    def score(self, query: str, passages: List[str]) -> List[float]:
+        terms = set(tokenize(query))
+        if not terms:
+            return [0.0] * len(passages)
+        return [len(terms & set(tokenize(passage))) / len(terms) for passage in passages]
+
+
+class CrossEncoderReranker:
+    """sentence-transformers cross-encoder, loaded once and scored in batches on CPU."""
+
+    def __init__(self, model_name: str = RERANKER_MODEL, batch_size: int = RERANKER_BATCH_SIZE):
+        from sentence_transformers import CrossEncoder
+
+        self.model = CrossEncoder(model_name, device="cpu")
+        self.batch_size = batch_size
+        logger.info(f"Loaded reranker model {model_name}")
+
+    def score(self, query: str, passages: List[str]) -> List[float]:
+        if not passages:
+            return []
+        scores = self.model.predict(
+            [(query, passage) for passage in passages],
+            batch_size=self.batch_size,
+            show_progress_bar=False,
+        )
+        return [float(score) for score in scores]
+
+
+def get_reranker(backend: Optional[str] = None):
+    """Reranker selected by RERANKER ("cross-encoder", "lexical" or "off").
+
+    The cross-encoder needs sentence-transformers; if it can't be loaded, reranking is turned
+    off (plain retrieval order) rather than replaced by the lexical scorer, which is only
+    used when RERANKER=lexical is set explicitly.
+    """
+    backend = (backend or os.getenv("RERANKER", "cross-encoder")).lower()
+    if backend == "off":
+        return None
+    if backend == "lexical":
+        return LexicalOverlapReranker()
+    if backend != "cross-encoder":
+        raise ValueError(f"Unknown reranker backend: {backend}")
+    try:
+        return CrossEncoderReranker()
+    except ImportError:
+        logger.error(
+            "RERANKER=cross-encoder but sentence-transformers is not installed; reranking is DISABLED. "
+            "Install sentence-transformers or set RERANKER=off to silence this."
+        )
+    except Exception as e:
+        logger.error(f"Could not load reranker model {RERANKER_MODEL}; reranking is DISABLED: {str(e)}")
+    return None
+
+
+def _passage(entry: Any) -> str:
+    return entry["content"] if isinstance(entry, dict) else entry
+
+
+def rerank(reranker, query: str, entries: List[Any], k: int, token_budget: int) -> List[Any]:
+    """Best k text/table entries that fit in token_budget, best first, followed by the images.
+
+    Images can't be scored against the question as text, so they pass through unchanged and
+    are budgeted by the prompt builder.
+    """
+    images = [entry for entry in entries if isinstance(entry, dict) and entry.get("modality") == IMAGE]
+    passages = [entry for entry in entries if not (isinstance(entry, dict) and entry.get("modality") == IMAGE)]
+    scores = reranker.score(query, [_passage(entry) for entry in passages])
+
+    kept, used = [], 0
+    for _, entry in sorted(zip(scores, passages), key=lambda pair: pair[0], reverse=True):
+        if len(kept) == k:
+            break
+        cost = estimate_tokens(_passage(entry))
+        if used + cost > token_budget:
+            continue
+        kept.append(entry)
+        used += cost
+    return kept + images
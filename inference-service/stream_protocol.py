@@ -0,0 +1,92 @@
+import json
+import os
+import time
+from typing import Any, Dict, Optional
+
+from langchain_core.messages.ai import add_usage
+
+
+STREAM_COALESCE_CHARS = int(os.getenv("STREAM_COALESCE_CHARS", 64))
+STREAM_COALESCE_MS = float(os.getenv("STREAM_COALESCE_MS", 40))
+
+# Response framings of /api/generate/stream: raw text deltas, Server-Sent Events, or one JSON event per line
+TEXT = "text"
+SSE = "sse"
+NDJSON = "ndjson"
+MEDIA_TYPES = {
+    TEXT: "text/plain",
+    SSE: "text/event-stream",
+    NDJSON: "application/x-ndjson",
+}
+
+
+def negotiate_format(requested: Optional[str], accept: str) -> str:
+    """Explicit ?format= wins; otherwise the Accept header; plain text by default."""
+    if requested:
+        requested = requested.lower()
+        if requested not in MEDIA_TYPES:
+            raise ValueError(f"Unknown stream format {requested!r}, expected one of {sorted(MEDIA_TYPES)}")
+        return requested
+    if MEDIA_TYPES[SSE] in accept:
+        return SSE
+    if MEDIA_TYPES[NDJSON] in accept:
+        return NDJSON
+    return TEXT
+
+
+def encode_event(event: Dict[str, Any], stream_format: str) -> Optional[str]:
+    """Frame one event; the plain text format only carries token deltas."""
+    if stream_format == SSE:
+        return f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+    if stream_format == NDJSON:
+        return json.dumps(event) + "\n"
+    return event["text"] if event["type"] == "delta" else None
+
+
+def message_text(chunk: Any) -> str:
+    """Text of a streamed message chunk (content may be a list of parts)."""
+    content = getattr(chunk, "content", chunk)
+    if isinstance(content, str):
+        return content
+    return "".join(part if isinstance(part, str) else part.get("text", "") for part in content)
+
+
+def accumulate_usage(total: Optional[Dict[str, int]], chunk: Any) -> Optional[Dict[str, int]]:
+    """Sum the usage_metadata that providers attach to streamed message chunks."""
+    usage = getattr(chunk, "usage_metadata", None)
+    if not usage:
+        return total
+    return dict(add_usage(total, usage))
+
+
+class TokenCoalescer:
+    """Buffers token deltas and releases them in batches of ~max_chars or every max_ms."""
+
+    def __init__(self, max_chars: int = STREAM_COALESCE_CHARS, max_ms: float = STREAM_COALESCE_MS):
+        self.max_chars = max_chars
+        self.max_seconds = max_ms / 1000
+        self._parts = []
+        self._size = 0
+        self._last_flush = time.monotonic()
+        self._flushed_any = False
+
+    def add(self, text: str) -> Optional[str]:
+        """Buffer text; returns a batch when one is due. The very first token goes out at once."""
+        self._parts.append(text)
+        self._size += len(text)
+        if (
+            not self._flushed_any
+            or self._size >= self.max_chars
+            or time.monotonic() - self._last_flush >= self.max_seconds
+        ):
+            return self.flush()
+        return None
+
+    def flush(self) -> Optional[str]:
+        if not self._parts:
+            return None
+        batch = "".join(self._parts)
+        self._parts, self._size = [], 0
+        self._last_flush = time.monotonic()
+        self._flushed_any = True
+        return batch
@@ -1,8 +1,10 @@
-from fastapi import FastAPI, UploadFile, HTTPException
+from fastapi import BackgroundTasks, FastAPI, UploadFile, HTTPException
 from fastapi.responses import JSONResponse
 from kafka import KafkaProducer
+import asyncio
+import httpx
 import json
-import requests
+import uuid
 from typing import List
 import os
 from pydantic import BaseModel
@@ -10,6 +12,7 @@ from datetime import datetime
 import logging
 from dotenv import load_dotenv
 
+from kafka_publisher import DeliveryTracker, KafkaOutbox, KafkaPublisher
 
 load_dotenv()
 
@@ -24,15 +27,34 @@ NODEJS_API_URL = os.getenv("NODEJS_API_URL", "http://localhost:3000/api/insert-f
 KAFKA_BOOTSTRAP_SERVERS = os.getenv("KAFKA_BOOTSTRAP_SERVERS", "localhost:9092")
 KAFKA_TOPIC = os.getenv("KAFKA_TOPIC", "file_uploads")
 MAX_FILES = 3  # 
+UPLOAD_TIMEOUT_SECONDS = float(os.getenv("UPLOAD_TIMEOUT_SECONDS", 300))
+KAFKA_OUTBOX_DIR = os.getenv("KAFKA_OUTBOX_DIR", "kafka_outbox")  # empty disables the outbox
+KAFKA_OUTBOX_REPLAY_SECONDS = float(os.getenv("KAFKA_OUTBOX_REPLAY_SECONDS", 30))
 
 
+# Sends are batched (linger/batch_size) and compressed; acks arrive through callbacks
 producer = KafkaProducer(
     bootstrap_servers=KAFKA_BOOTSTRAP_SERVERS,
     value_serializer=lambda v: json.dumps(v).encode('utf-8'),
-    key_serializer=lambda v: json.dumps(v).encode('utf-8')
+    key_serializer=lambda v: json.dumps(v).encode('utf-8'),
+    linger_ms=int(os.getenv("KAFKA_LINGER_MS", 20)),
+    batch_size=int(os.getenv("KAFKA_BATCH_SIZE", 64 * 1024)),
+    compression_type=os.getenv("KAFKA_COMPRESSION", "gzip"),
+    max_block_ms=int(os.getenv("KAFKA_MAX_BLOCK_MS", 5000)),
+    retries=int(os.getenv("KAFKA_RETRIES", 3))
+)
+publisher = KafkaPublisher(
+    producer,
+    outbox=KafkaOutbox(KAFKA_OUTBOX_DIR) if KAFKA_OUTBOX_DIR else None
 )
 logger.info("Successfully Connected to Kafka")
 
+# Pooled client shared by every request; uploads stream through it instead of being buffered
+http_client = httpx.AsyncClient(
+    timeout=httpx.Timeout(UPLOAD_TIMEOUT_SECONDS, connect=10.0),
+    limits=httpx.Limits(max_connections=50, max_keepalive_connections=20)
+)
+
 class FileUploadResponse(BaseModel):
     fileId: str
     downloadUrl: str
@@ -44,8 +66,44 @@ class MultipleFileUploadResponse(BaseModel):
     uploads: List[FileUploadResponse]
     total_processed: int
 
+async def forward_file(file: UploadFile, deliveries: DeliveryTracker) -> FileUploadResponse:
+    """Stream one upload to the storage service and announce it on Kafka."""
+    # UploadFile is already spooled to a temp file; httpx reads it in chunks while sending
+    await file.seek(0)
+    response = await http_client.post(
+        NODEJS_API_URL,
+        files={'file': (file.filename, file.file, file.content_type)}
+    )
+    if response.status_code != 200:
+        logger.error(f"Error uploading file {file.filename}: {response.text}")
+        raise HTTPException(
+            status_code=response.status_code,
+            detail=f"Error from Node.js API for file {file.filename}: {response.text}"
+        )
+
+    nodejs_response = response.json()
+    kafka_message = {
+        **nodejs_response,
+        "uploadTimestamp": datetime.utcnow().isoformat(),
+        "status": "success",
+        "originalFileName": file.filename,
+        "contentType": file.content_type
+    }
+    # Don't wait for the broker ack; the tracker reports delivery after the response is sent
+    delivery = await publisher.publish(KAFKA_TOPIC, value=kafka_message, key=nodejs_response["fileId"])
+    deliveries.track(file.filename, delivery)
+    logger.info(f"Message queued for Kafka topic {KAFKA_TOPIC} for file {file.filename}")
+
+    return FileUploadResponse(
+        fileId=nodejs_response["fileId"],
+        downloadUrl=nodejs_response["downloadUrl"],
+        fileName=nodejs_response["fileName"],
+        uploadTimestamp=kafka_message["uploadTimestamp"],
+        status="success"
+    )
+
 @app.post("/upload-multiple", response_model=MultipleFileUploadResponse)
-async def upload_files(files: List[UploadFile]):
+async def upload_files(files: List[UploadFile], background_tasks: BackgroundTasks):
     if not files:
         raise HTTPException(status_code=400, detail="No files provided")
     
@@ -55,58 +113,24 @@ async def upload_files(files: List[UploadFile]):
             detail=f"Maximum {MAX_FILES} files allowed per request"
         )
     
-    successful_uploads = []
-    
-    for file in files:
-        try:
-            file_content = await file.read()
-            files_data = {
-                'file': (file.filename, file_content, file.content_type)
-            }
-            response = requests.post(NODEJS_API_URL, files=files_data)
-            if response.status_code != 200:
-                logger.error(f"Error uploading file {file.filename}: {response.text}")
-                raise HTTPException(
-                    status_code=response.status_code,
-                    detail=f"Error from Node.js API for file {file.filename}: {response.text}"
-                )
-            
-            nodejs_response = response.json()
-            kafka_message = {
-                **nodejs_response,
-                "uploadTimestamp": datetime.utcnow().isoformat(),
-                "status": "success",
-                "originalFileName": file.filename,
-                "contentType": file.content_type
-            }
-            try:
-                future = producer.send(
-                    KAFKA_TOPIC,
-                    value=kafka_message,
-                    key=nodejs_response["fileId"]
-                )
-                future.get(timeout=10)
-                logger.info(f"Message sent to Kafka topic {KAFKA_TOPIC} for file {file.filename}")
-            except Exception as e:
-                logger.error(f"Failed to send message to Kafka for file {file.filename}: {str(e)}")
-            
-            successful_uploads.append(
-                FileUploadResponse(
-                    fileId=nodejs_response["fileId"],
-                    downloadUrl=nodejs_response["downloadUrl"],
-                    fileName=nodejs_response["fileName"],
-                    uploadTimestamp=kafka_message["uploadTimestamp"],
-                    status="success"
-                )
-            )
-            
-        except Exception as e:
-            logger.error(f"Error processing file {file.filename}: {str(e)}")
+    deliveries = DeliveryTracker(label=f"upload {uuid.uuid4().hex[:8]}")
+    background_tasks.add_task(deliveries.report)
+
+    # Files within one request are uploaded concurrently
+    results = await asyncio.gather(
+        *(forward_file(file, deliveries) for file in files),
+        return_exceptions=True
+    )
+    successful_uploads = [result for result in results if isinstance(result, FileUploadResponse)]
+
+    for file, result in zip(files, results):
+        if isinstance(result, Exception):
+            logger.error(f"Error processing file {file.filename}: {str(result)}")
             raise HTTPException(
                 status_code=500,
                 detail={
-                    "error": f"Error processing file {file.filename}: {str(e)}",
-                    "processed_files": successful_uploads,
+                    "error": f"Error processing file {file.filename}: {str(result)}",
+                    "processed_files": [upload.model_dump() for upload in successful_uploads],
                     "failed_file": file.filename
                 }
             )
@@ -116,7 +140,21 @@ async def upload_files(files: List[UploadFile]):
         total_processed=len(successful_uploads)
     )
 
+@app.on_event("startup")
+async def startup_event():
+    """Start replaying messages spooled while the broker was unavailable"""
+    if publisher.outbox is not None:
+        app.state.outbox_replayer = asyncio.create_task(
+            publisher.run_outbox_replayer(KAFKA_OUTBOX_REPLAY_SECONDS)
+        )
+
 @app.on_event("shutdown")
 async def shutdown_event():
     """Clean up resources on shutdown"""
+    replayer = getattr(app.state, "outbox_replayer", None)
+    if replayer is not None:
+        replayer.cancel()
+    await http_client.aclose()
+    # Flush batched messages before closing so nothing in the linger buffer is dropped
+    await asyncio.to_thread(producer.flush, 10)
     producer.close()
\ No newline at end of file
@@ -0,0 +1,228 @@
+import asyncio
+import json
+import logging
+import os
+import time
+import uuid
+from typing import Any, Dict, List, Optional, Tuple
+
+
+logger = logging.getLogger(__name__)
+
+
+class KafkaOutbox:
+    """
+    On-disk spool for messages the broker did not accept. One JSON file per message,
+    written atomically, so a crash never leaves a half-written entry behind.
+
+    Every uvicorn worker replays the same directory, so an entry is claimed with an atomic
+    rename before it is resent: only one worker can win the rename, and entries claimed by
+    a worker that died are released again after claim_timeout seconds.
+    """
+
+    CLAIM_MARKER = ".claimed."
+
+    def __init__(self, directory: str, claim_timeout: float = 300.0):
+        self.directory = directory
+        self.claim_timeout = claim_timeout
+        os.makedirs(directory, exist_ok=True)
+
+    def put(self, topic: str, key: Any, value: Any) -> str:
+        entry_id = uuid.uuid4().hex
+        path = os.path.join(self.directory, f"{entry_id}.json")
+        tmp_path = path + ".tmp"
+        with open(tmp_path, "w") as f:
+            json.dump({"topic": topic, "key": key, "value": value}, f)
+        os.replace(tmp_path, path)
+        return entry_id
+
+    def _release_stale_claims(self) -> None:
+        now = time.time()
+        for name in os.listdir(self.directory):
+            if self.CLAIM_MARKER not in name:
+                continue
+            original, _, claimed_at = name.partition(self.CLAIM_MARKER)
+            try:
+                if now - float(claimed_at) < self.claim_timeout:
+                    continue
+                os.rename(os.path.join(self.directory, name), os.path.join(self.directory, original))
+                logger.warning(f"Released stale outbox claim {name}")
+            except (ValueError, OSError):
+                continue
+
+    def pending(self) -> List[str]:
+        """Unclaimed entry ids, oldest first."""
+        self._release_stale_claims()
+        names = [name for name in os.listdir(self.directory) if name.endswith(".json")]
+        mtimes = {}
+        for name in names:
+            try:
+                mtimes[name] = os.path.getmtime(os.path.join(self.directory, name))
+            except FileNotFoundError:
+                # Claimed by another worker in the meantime
+                continue
+        return [name[:-len(".json")] for name in sorted(mtimes, key=mtimes.get)]
+
+    def claim(self, entry_id: str) -> Optional[Tuple[str, Dict[str, Any]]]:
+        """Take an entry for resending; returns (claim path, entry) or None if another worker has it."""
+        path = os.path.join(self.directory, f"{entry_id}.json")
+        claimed_path = f"{path}{self.CLAIM_MARKER}{time.time():.3f}"
+        try:
+            os.rename(path, claimed_path)
+        except FileNotFoundError:
+            return None
+        try:
+            with open(claimed_path) as f:
+                return claimed_path, json.load(f)
+        except (OSError, ValueError) as e:
+            logger.error(f"Skipping unreadable outbox entry {entry_id}: {str(e)}")
+            self.release(claimed_path)
+            return None
+
+    def release(self, claimed_path: str) -> None:
+        """Put a claimed entry back for a later replay."""
+        try:
+            os.rename(claimed_path, claimed_path.partition(self.CLAIM_MARKER)[0])
+        except FileNotFoundError:
+            pass
+
+    def remove(self, claimed_path: str) -> None:
+        try:
+            os.remove(claimed_path)
+        except FileNotFoundError:
+            pass
+
+
+class KafkaPublisher:
+    """
+    Non-blocking publishing on top of a batching KafkaProducer. Delivery results arrive
+    through producer callbacks and resolve asyncio futures; failed sends go to the
+    outbox (when configured) and are replayed by replay_outbox().
+    """
+
+    def __init__(self, producer, outbox: Optional[KafkaOutbox] = None):
+        self.producer = producer
+        self.outbox = outbox
+        self.stats = {"sent": 0, "delivered": 0, "failed": 0, "spooled": 0, "replayed": 0}
+        self.outstanding = 0
+
+    def _resolve(self, loop, future: asyncio.Future, result=None, error: Optional[Exception] = None):
+        def settle():
+            self.outstanding -= 1
+            if future.done():
+                return
+            if error is None:
+                future.set_result(result)
+            else:
+                future.set_exception(error)
+        loop.call_soon_threadsafe(settle)
+
+    def _spool(self, topic: str, key: Any, value: Any, error: Exception) -> bool:
+        if self.outbox is None:
+            return False
+        try:
+            self.outbox.put(topic, key, value)
+            self.stats["spooled"] += 1
+            logger.warning(f"Kafka send for key {key} failed ({str(error)}), spooled to outbox")
+            return True
+        except OSError as e:
+            logger.error(f"Could not spool Kafka message for key {key}: {str(e)}")
+            return False
+
+    async def publish(self, topic: str, value: Any, key: Any) -> asyncio.Future:
+        """
+        Hand a message to the producer and return a future for its delivery. The future
+        resolves to the record metadata, to None if the message was spooled to the outbox,
+        or raises if it was lost.
+        """
+        loop = asyncio.get_running_loop()
+        delivery = loop.create_future()
+        self.outstanding += 1
+        self.stats["sent"] += 1
+
+        def on_success(record_metadata):
+            self.stats["delivered"] += 1
+            self._resolve(loop, delivery, result=record_metadata)
+
+        def on_error(error):
+            self.stats["failed"] += 1
+            if self._spool(topic, key, value, error):
+                self._resolve(loop, delivery, result=None)
+            else:
+                self._resolve(loop, delivery, error=error)
+
+        try:
+            # send() only blocks while metadata is missing or the buffer is full; keep that off the loop
+            record_future = await asyncio.to_thread(self.producer.send, topic, value=value, key=key)
+        except Exception as e:
+            on_error(e)
+            return delivery
+        record_future.add_callback(on_success)
+        record_future.add_errback(on_error)
+        return delivery
+
+    async def replay_outbox(self) -> int:
+        """Resend spooled messages this worker manages to claim; each is removed once acknowledged."""
+        if self.outbox is None:
+            return 0
+        entry_ids = await asyncio.to_thread(self.outbox.pending)
+        replayed = 0
+        for entry_id in entry_ids:
+            claimed = await asyncio.to_thread(self.outbox.claim, entry_id)
+            if claimed is None:
+                continue
+            claimed_path, entry = claimed
+            try:
+                record_future = await asyncio.to_thread(
+                    self.producer.send, entry["topic"], value=entry["value"], key=entry["key"]
+                )
+                await asyncio.to_thread(record_future.get, 10)
+            except Exception as e:
+                await asyncio.to_thread(self.outbox.release, claimed_path)
+                logger.warning(f"Outbox replay stopped, broker still unavailable: {str(e)}")
+                break
+            await asyncio.to_thread(self.outbox.remove, claimed_path)
+            replayed += 1
+        if replayed:
+            self.stats["replayed"] += replayed
+            logger.info(f"Replayed {replayed} messages from the Kafka outbox")
+        return replayed
+
+    async def run_outbox_replayer(self, interval_seconds: float) -> None:
+        """Background loop that drains the outbox every interval_seconds."""
+        while True:
+            try:
+                await self.replay_outbox()
+            except Exception as e:
+                logger.error(f"Error replaying Kafka outbox: {str(e)}")
+            await asyncio.sleep(interval_seconds)
+
+
+class DeliveryTracker:
+    """Collects the delivery futures of one HTTP request and reports on them once settled."""
+
+    def __init__(self, label: str):
+        self.label = label
+        self._deliveries: List[Tuple[str, asyncio.Future]] = []
+
+    def track(self, name: str, delivery: asyncio.Future) -> None:
+        self._deliveries.append((name, delivery))
+
+    @property
+    def outstanding(self) -> int:
+        return sum(1 for _, delivery in self._deliveries if not delivery.done())
+
+    async def report(self, timeout: float = 60.0) -> None:
+        """Wait for all deliveries (up to timeout) and log the outcome."""
+        if not self._deliveries:
+            return
+        await asyncio.wait([delivery for _, delivery in self._deliveries], timeout=timeout)
+        for name, delivery in self._deliveries:
+            if not delivery.done():
+                logger.warning(f"[{self.label}] Kafka delivery for {name} still pending after {timeout}s")
+            elif delivery.exception() is not None:
+                logger.error(f"[{self.label}] Kafka delivery for {name} lost: {str(delivery.exception())}")
+            elif delivery.result() is None:
+                logger.warning(f"[{self.label}] Kafka delivery for {name} spooled to outbox")
+            else:
+                logger.info(f"[{self.label}] Kafka delivery for {name} confirmed")